@@ -8,8 +8,26 @@ The specific example here simply demonstrates how to check the weather in London
 with the API key read from an configuration file.
 '''
 
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import requests
 import configparser
+import threading
+import time
+
+# Editable parameters
+'''The OpenWeatherMap endpoint (override this to test against a local server)'''
+API_URL = "http://api.openweathermap.org/data/2.5/weather"
+
+'''Seconds for which the weather at a place is cached, and the maximum
+number of places to cache (the least recently used are evicted first)'''
+CACHE_TTL = 600
+CACHE_SIZE = 10000
+
+'''Default number of requests in flight at once for bulk lookups, which
+is also the number of connections kept alive'''
+MAX_CONCURRENCY = 8
 
 class WeatherChecker(configparser.ConfigParser):
     '''
@@ -19,11 +37,27 @@ class WeatherChecker(configparser.ConfigParser):
     
         wc = WeatherChecker()
         wc.get_weather_at_place("Some place name")
+        wc.get_weather_at_places(["Some place name","Another place name"])
+
+    Requests are made over a single keep-alive session, and responses are
+    cached per place, so repeated places only cost one request.
     '''
-    def __init__(self):
+    def __init__(self,api_url=API_URL,cache_ttl=CACHE_TTL,
+                 cache_size=CACHE_SIZE,max_concurrency=MAX_CONCURRENCY):
         '''
         Wrapper to ConfigParser, to read config file and store 
         the parameters in self
+
+        :param api_url: the OpenWeatherMap endpoint
+        :type api_url: str
+        :param cache_ttl: seconds for which responses are cached
+        :type cache_ttl: float
+        :param cache_size: maximum number of places to cache
+        :type cache_size: int
+        :param max_concurrency: default number of requests in flight at
+                                once for bulk lookups, and the number
+                                of connections to keep alive
+        :type max_concurrency: int
         '''
         # Read the config file
         super().__init__()
@@ -34,19 +68,108 @@ class WeatherChecker(configparser.ConfigParser):
         except KeyError as err:
             raise KeyError("Couldn't find DEFAULT.API_KEY variable in a "
                            "file api.config in this directory.")
-        
+        self.api_url = api_url
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.max_concurrency = max_concurrency
+        # Shared session, keeping connections alive between requests
+        self.session = requests.Session()
+        self._pool_size = 0
+        self._resize_pool(max_concurrency)
+        # Cache of place --> (expiry time, weather), in order of last use,
+        # and the futures of requests currently in flight
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _resize_pool(self,size):
+        '''Make sure that the session keeps at least size connections
+        alive, so that none are discarded when size requests are in
+        flight at once'''
+        if size <= self._pool_size:
+            return
+        adapter = HTTPAdapter(pool_connections=1,pool_maxsize=size)
+        for prefix in ("http://","https://"):
+            # Close the adapter being replaced, releasing its connections
+            self.session.get_adapter(prefix).close()
+            self.session.mount(prefix,adapter)
+        self._pool_size = size
+
+    def _fetch(self,place):
+        '''Request the weather at place from the API'''
+        params=dict(q=place,appid=self["DEFAULT"]["API_KEY"])
+        r = self.session.get(self.api_url,params=params)
+        r.raise_for_status()
+        return r.json()
+
     def get_weather_at_place(self,place):
         '''
-        A wrapper to the OpenWeatherMap API.
+        A wrapper to the OpenWeatherMap API. Cached responses are returned
+        if they are less than cache_ttl seconds old, and concurrent calls
+        for the same place share a single request.
         
         :param place: the query string for OpenWeatherMap
         :type place: str
         '''
-        url="http://api.openweathermap.org/data/2.5/weather"
-        params=dict(q=place,appid=self["DEFAULT"]["API_KEY"])
-        r = requests.get(url,params)
-        r.raise_for_status()
-        return r.json()
+        with self._lock:
+            # Use the cached response if it hasn't expired
+            if place in self._cache:
+                expiry,weather = self._cache[place]
+                if expiry > time.monotonic():
+                    self._cache.move_to_end(place)
+                    return weather
+                del self._cache[place]
+            # Wait for any request already in flight for this place
+            future = self._in_flight.get(place)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[place] = future
+        if not owner:
+            return future.result()
+        try:
+            weather = self._fetch(place)
+        except Exception as err:
+            # Errors aren't cached, so the next call will retry
+            with self._lock:
+                del self._in_flight[place]
+            future.set_exception(err)
+            raise
+        with self._lock:
+            del self._in_flight[place]
+            self._cache[place] = (time.monotonic() + self.cache_ttl,weather)
+            # Evict the least recently used places
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        future.set_result(weather)
+        return weather
+
+    def get_weather_at_places(self,places,max_concurrency=None):
+        '''
+        Bulk version of get_weather_at_place, returning a list of the
+        weather at each of places. Each distinct place is only requested
+        once, with up to max_concurrency requests in flight at once.
+
+        :param places: the query strings for OpenWeatherMap
+        :type places: list
+        :param max_concurrency: number of requests in flight at once
+                                (default: as given to the constructor).
+                                The connection pool grows to match.
+        :type max_concurrency: int
+        '''
+        if max_concurrency is None:
+            max_concurrency = self.max_concurrency
+        places = list(places)
+        unique = list(OrderedDict.fromkeys(places))
+        if max_concurrency <= 1:
+            weather = [self.get_weather_at_place(place) for place in unique]
+        else:
+            with self._lock:
+                self._resize_pool(max_concurrency)
+            with ThreadPoolExecutor(max_concurrency) as executor:
+                weather = list(executor.map(self.get_weather_at_place,unique))
+        weather = dict(zip(unique,weather))
+        return [weather[place] for place in places]
         
 # Write an example main routine in a __name__ == __main__ snippet
 if __name__ == "__main__":
@@ -54,3 +177,6 @@ if __name__ == "__main__":
     wc = WeatherChecker()
     weather = wc.get_weather_at_place("London,UK")
     print(weather)
+    # Get the weather at many (possibly repeated) places at once
+    weathers = wc.get_weather_at_places(["London,UK","Paris,FR","London,UK"])
+    print(weathers)
@@ -1,8 +1,132 @@
-from collections import Counter
-import nltk
+from array import array
+from functools import lru_cache
+from itertools import chain, islice, product
+from multiprocessing import Pool
+import json
 import numpy as np
-import pandas as pd
+import os
+import pickle
 import re 
+import shutil
+import tempfile
+import time
+import zlib
+
+@lru_cache(maxsize=None)
+def _english_stops():
+    '''The NLTK English stopwords, loaded on first use only'''
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+def _is_null(value):
+    '''As pandas.isnull, for a single value: None or NaN'''
+    return value is None or (isinstance(value,float) and value != value)
+
+class CompoundTrie:
+    '''Token trie of compounds, for scanning lists of tokens for the
+    longest compound starting at each position, in a single pass.'''
+    _END = None
+
+    def __init__(self,compounds=[]):
+        self.root = {}
+        self.size = 0
+        for _compound in compounds:
+            self.add(_compound)
+
+    def __len__(self):
+        return self.size
+
+    def add(self,compound):
+        '''Add a compound (a tuple of tokens) to the trie'''
+        node = self.root
+        for token in compound:
+            node = node.setdefault(token,{})
+        if self._END not in node:
+            self.size += 1
+        node[self._END] = compound
+
+    def longest_match(self,tokens,start):
+        '''Return the length of the longest compound in tokens starting
+        at position start (0 if there is none)'''
+        node = self.root
+        length = 0
+        for idx in range(start,len(tokens)):
+            node = node.get(tokens[idx])
+            if node is None:
+                break
+            if self._END in node:
+                length = idx - start + 1
+        return length
+
+    def remove(self,tokens):
+        '''Return tokens with any compounds removed, scanning left to right
+        and removing the longest compound at each position'''
+        _tokens = []
+        idx = 0
+        while idx < len(tokens):
+            length = self.longest_match(tokens,idx)
+            if length == 0:
+                _tokens.append(tokens[idx])
+                idx += 1
+            else:
+                idx += length
+        return _tokens
+
+class CompoundTransformer:
+    '''
+    Rewrites token lists (or documents) into compound tokens in a single
+    pass, replacing the longest compound starting at each position by its
+    tokens joined with <joiner>. Documents are lowercased and split into
+    tokens by <tokenizer> (by default, runs of alphanumerics, consistent
+    with AutoCompounder's sub-sentence splitting). Basic usage:
+
+        transformer = autocomp.transformer()
+        transformer.transform_tokens(["a","machine","learning","model"])
+        # --> ["a","machine_learning","model"]
+        for doc in transformer.transform(documents,workers=4):
+            ...
+    '''
+    def __init__(self,compounds,joiner="_",tokenizer=None):
+        self.trie = CompoundTrie(compounds)
+        self.joiner = joiner
+        if tokenizer is None:
+            tokenizer = re.compile(r"[a-zA-Z\d]+").findall
+        self.tokenizer = tokenizer
+
+    def transform_tokens(self,tokens):
+        '''Return tokens with compounds replaced by compound tokens'''
+        root = self.trie.root
+        _tokens = []
+        idx = 0
+        n_tokens = len(tokens)
+        while idx < n_tokens:
+            token = tokens[idx]
+            # Most tokens don't start a compound
+            length = 0
+            if token in root:
+                length = self.trie.longest_match(tokens,idx)
+            if length == 0:
+                _tokens.append(token)
+                idx += 1
+            else:
+                _tokens.append(self.joiner.join(tokens[idx:idx+length]))
+                idx += length
+        return _tokens
+
+    def transform_document(self,document):
+        '''Tokenise a document, and return its tokens with compounds
+        replaced by compound tokens'''
+        return self.transform_tokens(self.tokenizer(document.lower()))
+
+    def transform(self,documents,workers=1,chunksize=1000):
+        '''Lazily transform an iterable of documents (as for
+        transform_document), optionally over a pool of processes'''
+        if workers <= 1:
+            for document in documents:
+                yield self.transform_document(document)
+            return
+        with Pool(workers,initializer=_init_transformer,initargs=(self,)) as pool:
+            yield from pool.imap(_transform_worker,documents,chunksize=chunksize)
 
 class AutoCompounder:
     '''Extracts commonly associated words by extracting recursively smaller common n-grams,
@@ -13,12 +137,15 @@ class AutoCompounder:
     becomes 'stable' with threshold change. 'Stable' is defined as a threshold range of <alpha>
     standard deviations in which the change in word frequency is less than <beta>. The maximum 
     size of n-grams, from which the algorithm starts, is given by the <max_context> parameter.
+    Stop words are <default_stops> (by default the NLTK English stopwords) plus <extra_stops>.
+    An optional <metrics> callback is called as metrics(name,value) with the timings of each
+    stage (e.g. the n-gram counting for each context) and counts of sentences and compounds.
     '''
 
     def __init__(self,max_context=10,alpha=5,beta=0.05,
                  extra_stops=[],max_threshold=20.25,
                  threshold_increments=0.25,
-                 default_stops=nltk.corpus.stopwords.words('english')):
+                 default_stops=None,metrics=None):
 
         # Parameters from constructor
         self.max_context = max_context
@@ -26,20 +153,30 @@ class AutoCompounder:
         self.beta = beta        
         self.max_threshold = max_threshold
         self.threshold_increments = threshold_increments
-        self.stops = default_stops + extra_stops        
+        if default_stops is None:
+            default_stops = _english_stops()
+        self.stops = frozenset(default_stops).union(extra_stops)
+        self.metrics = metrics
 
         # Data to be filled
         self.data = []
         self.thresholds = {}
         self.compounds = []
         self.drop = {}
+        # N-gram count statistics per context, for partial_fit
+        self.counts = {}
         
+    def _emit(self,name,value=1):
+        '''Pass a timing or count to the metrics callback, if any'''
+        if self.metrics is not None:
+            self.metrics(name,value)
+
     def _extract_subsentences(self,sentences):
         '''Split up sentences sub-sentences, based on any non-alphanum'''
         _sentences = []
         for _sentence in sentences:
             # Ignore dodgy inputs
-            if pd.isnull(_sentence):
+            if _is_null(_sentence):
                 continue
             # Tokenise on any non-alphanum
             _sub_sentences = [x.rstrip(" ").lstrip(" ").lower() 
@@ -52,56 +189,305 @@ class AutoCompounder:
     def process_sentences(self,sentences):
         '''Iteratively extract compounds from sentences'''
         # Extract nested sentences, e.g. from paragraphs
-        print("Extracting nested sentences...")
+        start = time.perf_counter()
         _sentences = self._extract_subsentences(sentences)
-        print("Extracted a total of",len(_sentences),"sentences")
+        self._emit("autocompounder.extract_seconds",time.perf_counter()-start)
+        self._emit("autocompounder.sentences",len(_sentences))
+        # Split sentences into words, once only
+        start = time.perf_counter()
+        _tokenised = _word_tokenize(_sentences)
+        self._emit("autocompounder.tokenise_seconds",time.perf_counter()-start)
+        trie = CompoundTrie(self.compounds)
         # Iterate over context range
         the_range = np.arange(self.max_context,1,-1)
         for _context in the_range:
             # Remove any previous compounds from the sentence
-            for _c in self.compounds:
-                _sentences = [_s.replace(" ".join(_c),"") for _s in _sentences
-                              if not pd.isnull(_s)]
+            if len(trie) > 0:
+                start = time.perf_counter()
+                _tokenised = [trie.remove(_tokens) for _tokens in _tokenised]
+                self._emit("autocompounder.remove_seconds",time.perf_counter()-start)
             # Get compounds for this context
-            self.compounds += self._process_sentences(_sentences,_context)
+            _compounds = self._process_sentences(_tokenised,_context)
+            for _c in _compounds:
+                trie.add(_c)
+            self.compounds += _compounds
         # Select the compound words within the required context
         self.compounds = [_c for _c in self.compounds
                           if not self.drop[len(_c)]]
 
-    def _process_sentences(self,sentences,context):
-        '''Extract compounds from sentences with a given context'''
-        compounds = []
-        for words in self._preprocess(sentences):
-            # Get all compounds in this sentence
-            for _compound in nltk.ngrams(words,context):
-                # Ignore words starting or ending in stops
-                first_word = _compound[0]
-                last_word = _compound[-1]
-                if ((first_word in self.stops or first_word.isdigit()) or
-                    (last_word in self.stops or last_word.isdigit())):
-                    continue
-                # Append compound
-                compounds.append(_compound)
-        
-        # Count compounds
-        counts = Counter(compounds)
-        count_values = [x for x in counts.values()]
+    def process_sentences_sharded(self,sentences=None,paths=None,workers=4,
+                                  shard_size=10000,max_ngrams=10000000,
+                                  tmp_dir=None):
+        '''
+        As process_sentences, but for corpora which don't fit in memory:
+        the n-grams are counted per shard over a pool of processes, and
+        the counts are merged (spilling to disk beyond max_ngrams distinct
+        n-grams) before applying the threshold logic.
+
+        sentences: An iterable of sentences, which is split into shards
+                   of shard_size sentences
+        paths: Alternatively, a list of text files (one shard each) with
+               one sentence per line
+        workers: The number of processes
+        tmp_dir: Where to write the tokenised shards and spilled counts
+        '''
+        _tmp_dir = tempfile.mkdtemp(dir=tmp_dir)
+        try:
+            with Pool(workers) as pool:
+                # Tokenise each shard once, saving the tokens to disk
+                if paths is None:
+                    shards = ((_shard,None) for _shard in _chunks(sentences,shard_size))
+                else:
+                    shards = ((None,_path) for _path in paths)
+                tasks = ((_shard,_path,os.path.join(_tmp_dir,"shard-%d.pkl" % idx))
+                         for idx,(_shard,_path) in enumerate(shards))
+                shard_paths = []
+                n_sentences = 0
+                start = time.perf_counter()
+                for _shard_path,_n in pool.imap(_tokenise_shard,tasks):
+                    shard_paths.append(_shard_path)
+                    n_sentences += _n
+                self._emit("autocompounder.tokenise_seconds",time.perf_counter()-start)
+                self._emit("autocompounder.sentences",n_sentences)
+                self._emit("autocompounder.shards",len(shard_paths))
+                # Iterate over context range
+                the_range = np.arange(self.max_context,1,-1)
+                for _context in the_range:
+                    # Count n-grams per shard, after removing any previous
+                    # compounds, and merge the counts
+                    start = time.perf_counter()
+                    tasks = [(_shard_path,int(_context),self.compounds,self.stops)
+                             for _shard_path in shard_paths]
+                    counter = _SpillingCounter(os.path.join(_tmp_dir,"counts-%d" % _context),
+                                               max_ngrams)
+                    for _counts in pool.imap_unordered(_count_shard,tasks):
+                        counter.update(_counts)
+                    self._emit("autocompounder.context_%d.count_seconds" % _context,
+                               time.perf_counter()-start)
+                    self.compounds += self._select_merged(counter.partitions,_context)
+        finally:
+            shutil.rmtree(_tmp_dir)
+        # Select the compound words within the required context
+        self.compounds = [_c for _c in self.compounds
+                          if not self.drop[len(_c)]]
+
+    def partial_fit(self,sentences):
+        '''
+        Fold a new batch of sentences into the n-gram count statistics
+        (self.counts), and re-derive the thresholds and compounds from the
+        updated statistics. Before counting, the compounds re-derived for
+        larger contexts are removed from the new batch, but the counts
+        from earlier batches are not revisited. For a single batch, this
+        is equivalent to process_sentences.
+        '''
+        _sentences = self._extract_subsentences(sentences)
+        _tokenised = _word_tokenize(_sentences)
+        self._reset()
+        trie = CompoundTrie()
+        # Iterate over context range
+        the_range = np.arange(self.max_context,1,-1)
+        for _context in the_range:
+            # Remove any compounds for larger contexts from the sentences
+            if len(trie) > 0:
+                _tokenised = [trie.remove(_tokens) for _tokens in _tokenised]
+            # Update the counts for this context, and get its compounds
+            start = time.perf_counter()
+            counts = self.counts.setdefault(int(_context),{})
+            for _ngram,_count in self._ngram_counts(_tokenised,_context).items():
+                counts[_ngram] = counts.get(_ngram,0) + _count
+            self._emit("autocompounder.context_%d.count_seconds" % _context,
+                       time.perf_counter()-start)
+            _compounds = self._select_merged(lambda: [counts],_context)
+            for _c in _compounds:
+                trie.add(_c)
+            self.compounds += _compounds
+        # Select the compound words within the required context
+        self.compounds = [_c for _c in self.compounds
+                          if not self.drop[len(_c)]]
+
+    def sweep(self,sentences,param_grid,workers=1):
+        '''
+        Fit every combination of parameters in param_grid, a dict of
+        parameter name (max_context, alpha, beta, max_threshold or
+        threshold_increments) --> list of values, with any others taken
+        from this instance. The sentences are tokenised once, and
+        configurations share each n-gram count table for as long as
+        they have found the same compounds (so that the same compounds
+        have been removed from the sentences). The results are identical
+        to those of process_sentences for each configuration.
+
+        workers: The number of processes over which to tokenise the
+                 sentences and to split the configurations, once they
+                 have diverged
+
+        Returns a list (per combination, in the order of
+        itertools.product) of dicts of params, thresholds, drop and
+        compounds.
+        '''
+        defaults = dict(max_context=self.max_context,alpha=self.alpha,
+                        beta=self.beta,max_threshold=self.max_threshold,
+                        threshold_increments=self.threshold_increments)
+        names = list(param_grid)
+        params = [dict(defaults,**dict(zip(names,values)))
+                  for values in product(*(param_grid[name] for name in names))]
+        configs = [(idx,AutoCompounder(default_stops=self.stops,**_params))
+                   for idx,_params in enumerate(params)]
+        # Tokenise the sentences once
+        start = time.perf_counter()
+        if workers <= 1:
+            tokenised = _tokenise_chunk(sentences)
+        else:
+            with Pool(workers) as pool:
+                tokenised = list(chain.from_iterable(
+                    pool.imap(_tokenise_chunk,_chunks(sentences,10000))))
+        self._emit("autocompounder.tokenise_seconds",time.perf_counter()-start)
+        self._emit("autocompounder.sentences",len(tokenised))
+        # Configurations join the search at their own max_context, if
+        # no compounds have been found (and so removed) by then
+        pending = {}
+        for idx,config in configs:
+            pending.setdefault(config.max_context,[]).append((idx,config))
+        start = time.perf_counter()
+        counter = AutoCompounder(default_stops=self.stops)
+        nodes = [(tokenised,max(pending),[],[],pending)]
+        if workers <= 1:
+            n_tables = _sweep_nodes(counter,nodes)
+        else:
+            # Expand the largest branch of the search until none has more
+            # than its share of the configurations, and then search each
+            # branch in its own process
+            n_tables = 0
+            share = len(configs)/workers
+            while len(nodes) > 0:
+                sizes = [_node_size(node) for node in nodes]
+                largest = sizes.index(max(sizes))
+                if sizes[largest] <= share:
+                    break
+                children,n = _expand_node(counter,*nodes.pop(largest))
+                nodes += children
+                n_tables += n
+            tasks = [node[1:] for node in nodes]
+            with Pool(workers,initializer=_init_sweep,
+                      initargs=(counter,tokenised)) as pool:
+                for _configs,n in pool.imap_unordered(_sweep_worker,tasks):
+                    n_tables += n
+                    for idx,config in _configs:
+                        configs[idx] = (idx,config)
+        self._emit("autocompounder.sweep_seconds",time.perf_counter()-start)
+        self._emit("autocompounder.sweep_count_tables",n_tables)
+        results = []
+        for (_,config),_params in zip(configs,params):
+            # Select the compound words within the required context
+            compounds = [_c for _c in config.compounds if not config.drop[len(_c)]]
+            results.append(dict(params=_params,thresholds=config.thresholds,
+                                drop=config.drop,compounds=compounds))
+        return results
+
+    def _reset(self):
+        '''Forget any previously derived thresholds and compounds'''
+        self.data = []
+        self.thresholds = {}
+        self.compounds = []
+        self.drop = {}
+
+    def save(self,path):
+        '''Save the parameters and count statistics to a JSON file'''
+        params = dict(max_context=self.max_context,alpha=self.alpha,
+                      beta=self.beta,max_threshold=self.max_threshold,
+                      threshold_increments=self.threshold_increments,
+                      default_stops=sorted(self.stops))
+        counts = {str(_context):_counts for _context,_counts in self.counts.items()}
+        with open(path,"w") as f:
+            json.dump(dict(params=params,counts=counts),f)
+
+    @classmethod
+    def load(cls,path,metrics=None):
+        '''Load the output of save, re-deriving the thresholds and
+        compounds from the count statistics'''
+        with open(path) as f:
+            state = json.load(f)
+        autocomp = cls(metrics=metrics,**state["params"])
+        autocomp.counts = {int(_context):_counts
+                           for _context,_counts in state["counts"].items()}
+        the_range = np.arange(autocomp.max_context,1,-1)
+        for _context in the_range:
+            counts = autocomp.counts.get(int(_context),{})
+            autocomp.compounds += autocomp._select_merged(lambda: [counts],_context)
+        autocomp.compounds = [_c for _c in autocomp.compounds
+                              if not autocomp.drop[len(_c)]]
+        return autocomp
+
+    def _select_merged(self,partitions,context):
+        '''Extract compounds from merged n-gram counts with a given context,
+        where partitions() yields dicts of "joined n-gram" --> count'''
+        start = time.perf_counter()
+        count_values = np.fromiter((_count for _counts in partitions()
+                                    for _count in _counts.values()),dtype=np.int64)
+        threshold = self._find_threshold(count_values,context)
+        if threshold is None:
+            return []
+        cutoff,first = threshold
+        compounds = set(tuple(_ngram.split(" ")) for _counts in partitions()
+                        for _ngram,_count in _counts.items() if _count > cutoff)
+        # Drop contexts where the number of compounds hasn't changed
+        self.drop[context] = (len(compounds) == first)
+        self._emit("autocompounder.context_%d.select_seconds" % context,
+                   time.perf_counter()-start)
+        self._emit("autocompounder.context_%d.compounds" % context,len(compounds))
+        return compounds
+
+    def _process_sentences(self,tokenised,context):
+        '''Extract compounds from tokenised sentences with a given context'''
+        start = time.perf_counter()
+        vocab,ngrams,count_values = self._count_ngrams(self._preprocess(tokenised),
+                                                       context)
+        self._emit("autocompounder.context_%d.count_seconds" % context,
+                   time.perf_counter()-start)
+        self._emit("autocompounder.context_%d.ngrams" % context,len(count_values))
+        return self._select_counted(vocab,ngrams,count_values,context)
+
+    def _select_counted(self,vocab,ngrams,count_values,context):
+        '''Extract compounds with a given context from the output of
+        _count_ngrams'''
+        start = time.perf_counter()
+        threshold = self._find_threshold(count_values,context)
+        if threshold is None:
+            return []
+        cutoff,first = threshold
+        # Select the compounds passing the threshold condition
+        passed = np.flatnonzero(count_values > cutoff)
+        compounds = set(tuple(vocab[_id] for _id in ngrams[idx].tolist())
+                        for idx in passed)
+        # Drop contexts where the number of compounds hasn't changed
+        self.drop[context] = (len(compounds) == first) 
+        self._emit("autocompounder.context_%d.select_seconds" % context,
+                   time.perf_counter()-start)
+        self._emit("autocompounder.context_%d.compounds" % context,len(compounds))
+        return compounds
+
+    def _find_threshold(self,count_values,context):
+        '''Find the best threshold for the n-gram counts of this context,
+        returning the minimum count to pass the threshold and the number
+        of n-grams above the mean (or None if there are none)'''
         # Calculate the mean and std
         mean = np.mean(count_values)
         std = np.std(count_values)
         
-        # Calculate the threshold data for this context
-        first = sum(1 for _compound,_count in counts.items()
-                    if _count > mean)
+        # Calculate the threshold data for this context: the number of
+        # compounds above each threshold, from a single sorted array
+        sorted_counts = np.sort(count_values)
+        n_counts = len(sorted_counts)
+        first = n_counts - int(np.searchsorted(sorted_counts,mean,side="right"))
         if first == 0:
-            return []
+            return None
+        steps = np.arange(0,self.max_threshold,self.threshold_increments)
+        totals = n_counts - np.searchsorted(sorted_counts,mean + steps*std,
+                                            side="right")
         
         last_frac = 0
         best_threshold = 0
         found_any = False        
-        for i in np.arange(0,self.max_threshold,self.threshold_increments):
-            total = sum(1 for _compound,_count in counts.items()
-                        if _count > mean + i*std)
+        for i,total in zip(steps,totals.tolist()):
             # Calculate the total fraction removed due to this threshold            
             frac_removed = (first - total)/first
             
@@ -126,25 +512,57 @@ class AutoCompounder:
         if best_threshold == (self.max_threshold - self.threshold_increments):
             best_threshold = 0
         self.thresholds[context] = best_threshold
-        
-        # Filter out the compounds passing the threshold condition
-        for _compound,_count in counts.items():            
-            if _count <= mean + best_threshold*std:
-                compounds = list(filter((_compound).__ne__, compounds))
-        # Return unique compounds
-        compounds = set(compounds)
-        # Drop contexts where the number of compounds hasn't changed
-        self.drop[context] = (len(compounds) == first) 
-        return compounds
+        return mean + best_threshold*std,first
 
-    def _preprocess(self,sentences):
-        _sentences = []
-        for _sentence in sentences:
-            # Split sentences into words
-            words = nltk.word_tokenize(_sentence)
-            words = list(filter(lambda w: not w.isdigit(),words))
-            _sentences.append(words)
-        return _sentences
+    def _encode(self,tokenised):
+        '''Integer-encode tokenised sentences, returning the vocabulary,
+        the flat array of token ids and the sentence index of each token'''
+        vocab = {}
+        ids = array("i")
+        sentence_ids = array("i")
+        for idx,words in enumerate(tokenised):
+            ids.extend(vocab.setdefault(w,len(vocab)) for w in words)
+            sentence_ids.extend([idx]*len(words))
+        return (list(vocab),np.frombuffer(ids,dtype=np.int32),
+                np.frombuffer(sentence_ids,dtype=np.int32))
+
+    def _count_ngrams(self,tokenised,context):
+        '''Count the n-grams of size context which don't start or end in
+        stops, returning the vocabulary, an array of n-grams (as rows of
+        token ids) and their counts, in order of first occurrence'''
+        vocab,ids,sentence_ids = self._encode(tokenised)
+        n_windows = len(ids) - context + 1
+        if n_windows <= 0:
+            return vocab,np.zeros((0,context),dtype=np.int32),np.zeros(0,dtype=np.int64)
+        # Every window of context tokens, as a row
+        windows = np.stack([ids[k:k+n_windows] for k in range(context)],axis=1)
+        # Ignore windows spanning sentences, or starting or ending in stops
+        stops = self.stops
+        is_stop = np.array([w in stops or w.isdigit() for w in vocab],dtype=bool)
+        valid = ((sentence_ids[:n_windows] == sentence_ids[context-1:]) &
+                 ~is_stop[windows[:,0]] & ~is_stop[windows[:,-1]])
+        windows = np.ascontiguousarray(windows[valid])
+        # Count each window by viewing its row as a single value
+        keys = windows.view(np.dtype((np.void,windows.itemsize*context))).ravel()
+        _,first_idx,counts = np.unique(keys,return_index=True,return_counts=True)
+        order = np.argsort(first_idx)
+        return vocab,windows[first_idx[order]],counts[order]
+
+    def _ngram_counts(self,tokenised,context):
+        '''Count n-grams as for _count_ngrams, returning a dict of
+        "joined n-gram" --> count, in order of first occurrence'''
+        vocab,ngrams,counts = self._count_ngrams(self._preprocess(tokenised),context)
+        return {" ".join(vocab[_id] for _id in _ngram):_count
+                for _ngram,_count in zip(ngrams.tolist(),counts.tolist())}
+
+    def _preprocess(self,tokenised):
+        '''Remove numbers from tokenised sentences'''
+        return [[w for w in words if not w.isdigit()] for words in tokenised]
+
+    def transformer(self,joiner="_",tokenizer=None):
+        '''Compile the compounds into a CompoundTransformer'''
+        return CompoundTransformer(self.compounds,joiner=joiner,
+                                   tokenizer=tokenizer)
 
     def print_sorted_compounds(self):
         '''Method for printing compounds'''
@@ -152,6 +570,182 @@ class AutoCompounder:
         for _c in sorted(c):
             print(_c)
 
+def _word_tokenize(sentences):
+    '''Split each of sentences into words with NLTK (imported on first use)'''
+    import nltk
+    return [nltk.word_tokenize(_sentence) for _sentence in sentences]
+
+def _chunks(iterable,size):
+    '''Split an iterable into lists of up to size items'''
+    iterable = iter(iterable)
+    while True:
+        chunk = list(islice(iterable,size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def _tokenise_chunk(sentences):
+    '''Extract and tokenise the sub-sentences of sentences'''
+    _sentences = AutoCompounder(default_stops=[])._extract_subsentences(sentences)
+    return _word_tokenize(_sentences)
+
+def _tokenise_shard(task):
+    '''Worker: extract and tokenise the sub-sentences of a shard (given
+    as sentences, or a file path), saving the tokens to out_path'''
+    sentences,path,out_path = task
+    if path is not None:
+        with open(path,encoding="utf-8") as f:
+            sentences = [line.rstrip("\n") for line in f]
+    tokenised = _tokenise_chunk(sentences)
+    with open(out_path,"wb") as f:
+        pickle.dump(tokenised,f,protocol=pickle.HIGHEST_PROTOCOL)
+    return out_path,len(tokenised)
+
+def _count_shard(task):
+    '''Worker: remove compounds from a tokenised shard (saving the result)
+    and count its n-grams, returning a dict of "joined n-gram" --> count'''
+    path,context,compounds,stops = task
+    with open(path,"rb") as f:
+        tokenised = pickle.load(f)
+    if len(compounds) > 0:
+        trie = CompoundTrie(compounds)
+        tokenised = [trie.remove(_tokens) for _tokens in tokenised]
+        with open(path,"wb") as f:
+            pickle.dump(tokenised,f,protocol=pickle.HIGHEST_PROTOCOL)
+    return AutoCompounder(default_stops=stops)._ngram_counts(tokenised,context)
+
+class _SpillingCounter:
+    '''Merges n-gram count tables in memory, spilling to hash-partitioned
+    files under path whenever there are more than max_ngrams n-grams'''
+    def __init__(self,path,max_ngrams,n_partitions=16):
+        self.path = path
+        self.max_ngrams = max_ngrams
+        self.n_partitions = n_partitions
+        self.counts = {}
+        self.spilled = False
+
+    def update(self,counts):
+        for _ngram,_count in counts.items():
+            self.counts[_ngram] = self.counts.get(_ngram,0) + _count
+        if len(self.counts) > self.max_ngrams:
+            self._spill()
+
+    def _partition_path(self,idx):
+        return os.path.join(self.path,"part-%d.tsv" % idx)
+
+    def _spill(self):
+        os.makedirs(self.path,exist_ok=True)
+        files = [open(self._partition_path(idx),"a",encoding="utf-8")
+                 for idx in range(self.n_partitions)]
+        for _ngram,_count in self.counts.items():
+            idx = zlib.crc32(_ngram.encode("utf-8")) % self.n_partitions
+            files[idx].write(_ngram+"\t"+str(_count)+"\n")
+        for f in files:
+            f.close()
+        self.counts = {}
+        self.spilled = True
+
+    def partitions(self):
+        '''Yield dicts of merged counts, which together cover every n-gram'''
+        if not self.spilled:
+            yield self.counts
+            return
+        if len(self.counts) > 0:
+            self._spill()
+        for idx in range(self.n_partitions):
+            counts = {}
+            with open(self._partition_path(idx),encoding="utf-8") as f:
+                for line in f:
+                    _ngram,_count = line.rstrip("\n").split("\t")
+                    counts[_ngram] = counts.get(_ngram,0) + int(_count)
+            yield counts
+
+def _expand_node(counter,tokenised,context,history,configs,pending):
+    '''
+    Expand a node of AutoCompounder.sweep: the configurations (pairs of
+    index, AutoCompounder) which have found the compounds in history (a
+    list, per larger context, of sets of compounds) so far. The
+    compounds are removed from tokenised, and the n-grams of size
+    context are counted once for all configurations. Returns the child
+    nodes, per set of compounds found, and the number of count tables.
+    '''
+    if len(history) == 0:
+        configs = configs + pending.pop(context,[])
+    if context < 2 or len(configs) == 0 and len(pending) == 0:
+        return [],0
+    if len(history) > 0:
+        trie = CompoundTrie(chain.from_iterable(history))
+        tokenised = [trie.remove(_tokens) for _tokens in tokenised]
+    groups = {}
+    n_tables = 0
+    if len(configs) > 0:
+        counted = counter._count_ngrams(counter._preprocess(tokenised),context)
+        n_tables = 1
+        for idx,config in configs:
+            _compounds = config._select_counted(*counted,context)
+            config.compounds += _compounds
+            groups.setdefault(frozenset(_compounds),[]).append((idx,config))
+    # Configurations with a max_context below this context can only
+    # join the branch which hasn't found any compounds yet
+    if len(history) == 0:
+        groups.setdefault(frozenset(),[])
+    children = []
+    for _compounds,group in groups.items():
+        _history = history + [_compounds]
+        if len(history) == 0 and len(_compounds) == 0:
+            children.append((tokenised,context-1,[],group,pending))
+        else:
+            children.append((tokenised,context-1,_history,group,{}))
+    return children,n_tables
+
+def _node_size(node):
+    '''The number of configurations searched from a node of
+    AutoCompounder.sweep'''
+    *_,configs,pending = node
+    return len(configs) + sum(len(_configs) for _configs in pending.values())
+
+def _sweep_nodes(counter,nodes):
+    '''Search the nodes of AutoCompounder.sweep depth-first, returning
+    the number of count tables'''
+    n_tables = 0
+    while len(nodes) > 0:
+        children,n = _expand_node(counter,*nodes.pop())
+        nodes += children
+        n_tables += n
+    return n_tables
+
+'''The counting AutoCompounder and tokenised sentences used by each
+sweep worker process'''
+_worker_sweep = None
+
+def _init_sweep(counter,tokenised):
+    global _worker_sweep
+    _worker_sweep = (counter,tokenised)
+
+def _sweep_worker(task):
+    '''Search a node of AutoCompounder.sweep (without its tokenised
+    sentences, which are rebuilt from its history), returning its
+    configurations and the number of count tables'''
+    context,history,configs,pending = task
+    counter,tokenised = _worker_sweep
+    # Remove the compounds as they were found, up to the parent node
+    for depth in range(1,len(history)):
+        trie = CompoundTrie(chain.from_iterable(history[:depth]))
+        tokenised = [trie.remove(_tokens) for _tokens in tokenised]
+    searched = configs + list(chain.from_iterable(pending.values()))
+    n_tables = _sweep_nodes(counter,[(tokenised,context,history,configs,pending)])
+    return searched,n_tables
+
+'''The CompoundTransformer used by each worker process'''
+_worker_transformer = None
+
+def _init_transformer(transformer):
+    global _worker_transformer
+    _worker_transformer = transformer
+
+def _transform_worker(document):
+    return _worker_transformer.transform_document(document)
+
 #___________________
 # Example of how to run
 if __name__ == "__main__":
@@ -171,4 +765,15 @@ if __name__ == "__main__":
 
     # Note: compounds can be accessed from autocomp.compounds
     # if you want to filter these from your original words, you
-    # should start with large n-grams, and recurse to small n-grams
+    # should start with large n-grams, and recurse to small n-grams.
+    # Alternatively, rewrite documents into compound tokens with:
+    transformer = autocomp.transformer()
+    for tokens in transformer.transform(sentences[:5]):
+        print(tokens)
+
+    # To compare hyperparameters, sweep over a grid of them: the
+    # n-gram counts are shared between configurations where possible
+    results = autocomp.sweep(sentences,dict(alpha=[3,5],beta=[0.05,0.1]),
+                             workers=4)
+    for result in results:
+        print(result["params"],len(result["compounds"]))
@@ -0,0 +1,330 @@
+'''
+benchmarks.benchmark
+~~~~~~~~~~~~~~~
+
+Offline benchmarks for the hot paths of the toolbox, on synthetic data
+from benchmarks.generators (and a local MAK stub from benchmarks.mak_stub).
+Each case is run at several data sizes, each in a fresh process, and the
+throughput (items per second) and peak memory (max RSS) are reported.
+
+Usage:
+
+    python benchmark.py                           # all cases
+    python benchmark.py superfuzz mak_batching    # selected cases
+    python benchmark.py --sizes 1000,10000        # override data sizes
+    python benchmark.py --save-baseline base.json
+    python benchmark.py --baseline base.json      # flag regressions
+    python benchmark.py --timeout 600             # limit each run to 10 mins
+    python benchmark.py imports                   # module import time
+
+Note that the autocompounder cases need the NLTK "stopwords" and "punkt"
+data to be installed locally.
+'''
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import queue as queue_module
+import resource
+import sys
+import tempfile
+import time
+import traceback
+from multiprocessing import get_context
+from os.path import join as pjoin
+
+# Make the toolbox modules importable
+HERE = os.path.dirname(os.path.abspath(__file__))
+for _module_dir in ("superfuzz","microsoft_academic_knowledge","autocompounder"):
+    sys.path.insert(0,pjoin(HERE,"..",_module_dir))
+
+import generators
+
+# Editable parameters
+'''Default data sizes for each case, where the meaning of "size" is given
+in each case's docstring'''
+DEFAULT_SIZES = {"superfuzz":[500,5000],
+                 "superfuzz_topk":[500,5000],
+                 "combo_fuzz":[500,5000],
+                 "combo_fuzz_many":[500,5000],
+                 "latlon_init":[10000,50000],
+                 "latlon_process":[10000,50000],
+                 "title_process":[10000,100000],
+                 "mak_batching":[10000,50000],
+                 "autocompounder":[2000,20000],
+                 "autocompounder_sweep":[2000,20000],
+                 "imports":[1]}
+
+'''Relative slow-down or growth in peak memory (vs the baseline) flagged
+as a regression'''
+TOLERANCE = 0.2
+
+'''Seconds after which a run (of one case at one size) is stopped and
+reported as failed (None for no limit)'''
+TIMEOUT = 3600
+
+'''Seconds between checks that a run is still alive'''
+POLL_INTERVAL = 1
+
+'''Number of queries for the fuzzy matching cases'''
+N_QUERIES = 20
+
+# Benchmark cases: each setup function returns the arguments for its run
+# function, which returns the number of items processed
+def setup_superfuzz(size,tmp_dir):
+    '''size: number of choices, matched against N_QUERIES queries'''
+    from fuzzywuzzy import fuzz
+    names = generators.noisy_names(generators.write_grid(tmp_dir,size),size)
+    return names[:N_QUERIES],names,[fuzz.ratio,fuzz.token_sort_ratio]
+
+def run_superfuzz(queries,choices,algs):
+    from superfuzz import superfuzz
+    for query in queries:
+        for choice in choices:
+            superfuzz(query,choice,algs)
+    return len(queries)*len(choices)
+
+def setup_superfuzz_topk(size,tmp_dir):
+    '''size: number of choices, matched against N_QUERIES queries'''
+    return setup_superfuzz(size,tmp_dir)
+
+def run_superfuzz_topk(queries,choices,algs):
+    from superfuzz import superfuzz_topk, length_ratio_bound
+    superfuzz_topk(queries,choices,algs,k=5,min_score=60,
+                   bounds=[length_ratio_bound,None])
+    return len(queries)*len(choices)
+
+def setup_combo_fuzz(size,tmp_dir):
+    '''size: number of candidates, scored against N_QUERIES targets'''
+    from geocode_mak import ComboFuzzer
+    from fuzzywuzzy import fuzz
+    names = generators.noisy_names(generators.write_grid(tmp_dir,size),size)
+    cf = ComboFuzzer([fuzz.token_sort_ratio,fuzz.partial_ratio])
+    return cf,names[:N_QUERIES],names
+
+def run_combo_fuzz(cf,targets,candidates):
+    for target in targets:
+        for candidate in candidates:
+            cf.combo_fuzz(target,candidate)
+    return len(targets)*len(candidates)
+
+def setup_combo_fuzz_many(size,tmp_dir):
+    '''size: number of candidates, scored against N_QUERIES targets'''
+    return setup_combo_fuzz(size,tmp_dir)
+
+def run_combo_fuzz_many(cf,targets,candidates):
+    cf.combo_fuzz_matrix(targets,candidates)
+    return len(targets)*len(candidates)
+
+def setup_latlon_init(size,tmp_dir):
+    '''size: number of GRID institutes'''
+    from geocode_mak import ComboFuzzer
+    from fuzzywuzzy import fuzz
+    generators.write_grid(tmp_dir,size)
+    cf = ComboFuzzer([fuzz.token_sort_ratio,fuzz.partial_ratio])
+    return tmp_dir,cf,size
+
+def run_latlon_init(grid_path,cf,size):
+    from geocode_mak import LatLonGetter
+    LatLonGetter(grid_path,cf.combo_fuzz)
+    return size
+
+def setup_latlon_process(size,tmp_dir):
+    '''size: number of GRID institutes, against which 1000 noisy
+    institute names are matched'''
+    from geocode_mak import ComboFuzzer, LatLonGetter
+    from fuzzywuzzy import fuzz
+    names = generators.write_grid(tmp_dir,size)
+    cf = ComboFuzzer([fuzz.token_sort_ratio,fuzz.partial_ratio])
+    return LatLonGetter(tmp_dir,cf.combo_fuzz),generators.noisy_names(names,1000)
+
+def run_latlon_process(llg,mak_names):
+    llg.process_latlons(mak_names)
+    return len(mak_names)
+
+def setup_title_process(size,tmp_dir):
+    '''size: number of titles'''
+    from mak_from_titles import TitleProcessor
+    return TitleProcessor(),[title for _,title in generators.arxiv_titles(size)]
+
+def run_title_process(tp,titles):
+    for title in titles:
+        tp.process_title(title)
+    return len(titles)
+
+def setup_mak_batching(size,tmp_dir):
+    '''size: number of titles, queried against a local MAK stub'''
+    from mak_stub import serve_mak_stub
+    _,api_url = serve_mak_stub()
+    return generators.arxiv_titles(size),api_url
+
+def run_mak_batching(raw_titles,api_url):
+    from mak_from_titles import mak_from_titles
+    mak_from_titles(raw_titles,call_limit=len(raw_titles),api_url=api_url)
+    return len(raw_titles)
+
+def setup_autocompounder(size,tmp_dir):
+    '''size: number of sentences'''
+    return (generators.text_corpus(size),)
+
+def run_autocompounder(sentences):
+    from autocompounder import AutoCompounder
+    AutoCompounder(max_context=6).process_sentences(sentences)
+    return len(sentences)
+
+def setup_autocompounder_sweep(size,tmp_dir):
+    '''size: number of sentences, swept over a grid of 8 configurations'''
+    return (generators.text_corpus(size),)
+
+def run_autocompounder_sweep(sentences):
+    from autocompounder import AutoCompounder
+    AutoCompounder(max_context=6).sweep(sentences,dict(alpha=[3,5],beta=[0.05,0.1],
+                                                       max_context=[4,6]))
+    return len(sentences)
+
+def setup_imports(size,tmp_dir):
+    '''size: ignored, since each module can only be imported once per
+    (fresh) process'''
+    return (["superfuzz","geocode_mak","mak_from_titles","autocompounder"],)
+
+def run_imports(modules):
+    for module in modules:
+        importlib.import_module(module)
+    return len(modules)
+
+CASES = list(DEFAULT_SIZES)
+
+def _peak_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def _run_case(case,size,queue):
+    '''Run a single case in this (fresh) process, putting the results
+    on queue'''
+    module = sys.modules[__name__]
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Silence any progress output from the toolbox
+            with contextlib.redirect_stdout(io.StringIO()), \
+                 contextlib.redirect_stderr(io.StringIO()):
+                args = getattr(module,"setup_"+case)(size,tmp_dir)
+                setup_mb = _peak_mb()
+                start = time.perf_counter()
+                n_items = getattr(module,"run_"+case)(*args)
+                seconds = time.perf_counter() - start
+    except Exception as err:
+        # Report the first line of the message, with the full traceback
+        # on stderr
+        traceback.print_exc()
+        lines = [line for line in str(err).splitlines() if line.strip(" *")]
+        error = type(err).__name__ + (": "+lines[0].strip() if lines else "")
+        queue.put(dict(case=case,size=size,error=error))
+        return
+    queue.put(dict(case=case,size=size,seconds=seconds,
+                   items_per_second=n_items/seconds,
+                   peak_mb=_peak_mb(),setup_mb=setup_mb))
+
+def run_benchmark(case,size,timeout=TIMEOUT):
+    '''Run a case at a given size in a fresh process, returning a dict
+    of timings and memory usage, or of the error if the run failed,
+    died or exceeded timeout seconds'''
+    ctx = get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_case,args=(case,size,queue))
+    process.start()
+    start = time.perf_counter()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=POLL_INTERVAL)
+        except queue_module.Empty:
+            if not process.is_alive():
+                # Check for a result put just before the process exited
+                try:
+                    result = queue.get(timeout=POLL_INTERVAL)
+                except queue_module.Empty:
+                    result = dict(case=case,size=size,error="process died "
+                                  "with exit code %s" % process.exitcode)
+            elif timeout is not None and time.perf_counter() - start > timeout:
+                process.terminate()
+                result = dict(case=case,size=size,
+                              error="timed out after %ss" % timeout)
+    process.join()
+    return result
+
+def compare(results,baseline,tolerance=TOLERANCE):
+    '''Add the throughput and peak memory ratios vs the baseline to each
+    result, and flag regressions (slow-down or memory growth) beyond
+    tolerance'''
+    previous = {(row["case"],row["size"]):row for row in baseline
+                if "error" not in row}
+    for row in results:
+        base = previous.get((row["case"],row["size"]))
+        if base is None or "error" in row:
+            continue
+        row["ratio"] = row["items_per_second"]/base["items_per_second"]
+        row["regression"] = row["ratio"] < 1 - tolerance
+        row["mem_ratio"] = row["peak_mb"]/base["peak_mb"]
+        row["mem_regression"] = row["mem_ratio"] > 1 + tolerance
+    return results
+
+def print_results(results):
+    print("%-20s %8s %10s %14s %10s %8s %8s" % ("case","size","seconds",
+                                                "items/s","peak MB",
+                                                "vs base","mem vs"))
+    for row in results:
+        if "error" in row:
+            print("%-20s %8d FAILED: %s" % (row["case"],row["size"],row["error"]))
+            continue
+        ratio,mem_ratio = "",""
+        if "ratio" in row:
+            ratio = "%.2fx" % row["ratio"] + (" !!" if row["regression"] else "")
+            mem_ratio = "%.2fx" % row["mem_ratio"] + (" !!" if row["mem_regression"] else "")
+        print("%-20s %8d %10.3f %14.1f %10.1f %8s %8s" % (row["case"],row["size"],
+                                                          row["seconds"],
+                                                          row["items_per_second"],
+                                                          row["peak_mb"],ratio,
+                                                          mem_ratio))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("Usage:")[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cases",nargs="*",default=CASES,
+                        help="Cases to run, from: "+", ".join(CASES)+
+                        " (default: all)")
+    parser.add_argument("--sizes",help="Comma-separated data sizes, "
+                        "overriding the defaults for each case")
+    parser.add_argument("--baseline",help="JSON file of previous results "
+                        "to compare against")
+    parser.add_argument("--save-baseline",help="Save the results to this JSON file")
+    parser.add_argument("--tolerance",type=float,default=TOLERANCE,
+                        help="Relative slow-down or memory growth flagged "
+                        "as a regression")
+    parser.add_argument("--timeout",type=float,default=TIMEOUT,
+                        help="Seconds after which a run is reported as failed")
+    args = parser.parse_args()
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error("unknown cases: "+", ".join(sorted(unknown)))
+
+    results = []
+    for case in args.cases:
+        sizes = DEFAULT_SIZES[case]
+        if args.sizes is not None:
+            sizes = [int(size) for size in args.sizes.split(",")]
+        for size in sizes:
+            results.append(run_benchmark(case,size,args.timeout))
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            compare(results,json.load(f),args.tolerance)
+    print_results(results)
+    if args.save_baseline is not None:
+        with open(args.save_baseline,"w") as f:
+            json.dump(results,f,indent=2)
+    # Exit with an error if anything failed or regressed
+    if any("error" in row or row.get("regression",False) or
+           row.get("mem_regression",False) for row in results):
+        sys.exit(1)
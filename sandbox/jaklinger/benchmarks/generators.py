@@ -0,0 +1,149 @@
+'''
+benchmarks.generators
+~~~~~~~~~~~~~~~
+
+Reproducible generators of synthetic data for benchmarking the toolbox,
+all of which are seeded so that repeated runs see identical data.
+
+Usage:
+
+    write_grid(grid_path,n_institutes)  # grid.csv, full_tables/*.csv
+    names = noisy_names(institute_names,n_names)
+    titles = arxiv_titles(n_titles)
+    sentences = text_corpus(n_sentences)
+'''
+
+import csv
+import os
+import random
+from os.path import join as pjoin
+
+# Editable parameters
+'''Words from which institute names are built'''
+INSTITUTE_WORDS = ["university","institute","college","school","academy",
+                   "national","royal","technical","state","federal",
+                   "research","science","technology","medicine","engineering",
+                   "arts","health","marine","agricultural","polytechnic"]
+PLACE_WORDS = ["london","paris","berlin","tokyo","sharjah","milan","dubai",
+               "washington","california","oxford","cambridge","madrid",
+               "vienna","zurich","delhi","beijing","toronto","sydney",
+               "lagos","lima","abu","dhabi","new","york","san","diego"]
+
+'''Words from which titles and sentences are built, plus some common
+multi-word phrases which the autocompounder should find'''
+TOPIC_WORDS = ["quantum","neural","network","learning","decay","boson",
+               "higgs","detector","graph","optimal","stochastic","model",
+               "analysis","search","data","energy","spin","field","theory",
+               "galaxy","protein","dynamics","inference","sparse","random"]
+FILLER_WORDS = ["the","of","a","in","for","and","with","on","to","using",
+                "via","from","at","by","towards"]
+PHRASES = [["machine","learning"],["neural","network","model"],
+           ["dark","matter"],["climate","change"],["united","kingdom"],
+           ["higher","education","institute"],["large","hadron","collider"]]
+
+def _institute_name(rng):
+    words = ([rng.choice(INSTITUTE_WORDS) for _ in range(rng.randint(1,3))] +
+             ["of"] + [rng.choice(PLACE_WORDS) for _ in range(rng.randint(1,2))])
+    return " ".join(w.title() if w != "of" else w for w in words)
+
+def write_grid(grid_path,n_institutes,aliases_per_institute=0.5,seed=0):
+    '''
+    Write GRID-style grid.csv, full_tables/addresses.csv and
+    full_tables/aliases.csv files for n_institutes institutes under
+    grid_path. Returns the list of institute names.
+    '''
+    rng = random.Random(seed)
+    os.makedirs(pjoin(grid_path,"full_tables"),exist_ok=True)
+    names = []
+    with open(pjoin(grid_path,"grid.csv"),"w",newline="") as grid_f, \
+         open(pjoin(grid_path,"full_tables","addresses.csv"),"w",newline="") as addr_f, \
+         open(pjoin(grid_path,"full_tables","aliases.csv"),"w",newline="") as alias_f:
+        grid_csv = csv.writer(grid_f)
+        addr_csv = csv.writer(addr_f)
+        alias_csv = csv.writer(alias_f)
+        grid_csv.writerow(["ID","Name","City","State","Country"])
+        addr_csv.writerow(["grid_id","line_1","lat","lng","city","country"])
+        alias_csv.writerow(["grid_id","alias"])
+        for idx in range(n_institutes):
+            grid_id = "grid.%d.%d" % (1000+idx,rng.randint(0,9))
+            # Make names unique, as for real GRID data
+            name = _institute_name(rng)+" "+str(idx)
+            city = rng.choice(PLACE_WORDS).title()
+            names.append(name)
+            grid_csv.writerow([grid_id,name,city,"","Country"])
+            addr_csv.writerow([grid_id,"",round(rng.uniform(-90,90),6),
+                               round(rng.uniform(-180,180),6),city,"Country"])
+            n_aliases = int(aliases_per_institute) + (rng.random() <
+                                                      aliases_per_institute % 1)
+            for alias_idx in range(n_aliases):
+                alias_csv.writerow([grid_id,name.split(" of ")[0]+
+                                    " alias "+str(idx)+"-"+str(alias_idx)])
+    return names
+
+def noisy_names(names,n_names,noise=0.3,seed=0):
+    '''
+    Sample n_names lowercase names from names, with a fraction noise of
+    them corrupted (dropped, swapped or misspelt words) as for messy
+    MAK affiliations.
+    '''
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n_names):
+        words = rng.choice(names).lower().split()
+        if rng.random() < noise:
+            action = rng.randint(0,2)
+            pos = rng.randrange(len(words))
+            if action == 0 and len(words) > 1:
+                del words[pos]
+            elif action == 1:
+                other = rng.randrange(len(words))
+                words[pos],words[other] = words[other],words[pos]
+            else:
+                word = words[pos]
+                char = rng.randrange(len(word))
+                words[pos] = word[:char]+rng.choice("aeiou")+word[char+1:]
+        out.append(" ".join(words))
+    return out
+
+def arxiv_titles(n_titles,seed=0):
+    '''Return n_titles (ID, title) pairs, resembling raw arXiv titles
+    with punctuation, maths and the odd non-latin character'''
+    rng = random.Random(seed)
+    extras = ["$\\sqrt{s}=8$ TeV","p→K+ν","(II)","α-decay","2D","—","Ω"]
+    titles = []
+    for idx in range(n_titles):
+        words = []
+        for _ in range(rng.randint(4,16)):
+            roll = rng.random()
+            if roll < 0.05:
+                words.append(rng.choice(extras))
+            elif roll < 0.3:
+                words.append(rng.choice(FILLER_WORDS))
+            else:
+                words.append(rng.choice(TOPIC_WORDS))
+        words[0] = words[0].title()
+        titles.append((idx," ".join(words)+" "+str(idx)))
+    return titles
+
+def text_corpus(n_sentences,vocab_size=5000,phrase_rate=0.05,seed=0):
+    '''
+    Return n_sentences sentences of Zipf-distributed words, with common
+    phrases (see PHRASES) embedded at a rate of phrase_rate per word.
+    '''
+    rng = random.Random(seed)
+    vocab = ["w%05d" % idx for idx in range(vocab_size)]
+    sentences = []
+    for _ in range(n_sentences):
+        words = []
+        for _ in range(rng.randint(5,30)):
+            roll = rng.random()
+            if roll < phrase_rate:
+                words += rng.choice(PHRASES)
+            elif roll < 0.3:
+                words.append(rng.choice(FILLER_WORDS))
+            elif roll < 0.32:
+                words.append(str(rng.randint(1,999)))
+            else:
+                words.append(vocab[min(int(rng.paretovariate(1.1))-1,vocab_size-1)])
+        sentences.append(" ".join(words))
+    return sentences
@@ -0,0 +1,69 @@
+'''
+benchmarks.mak_stub
+~~~~~~~~~~~~~~~
+
+A local stand-in for the MAK evaluate endpoint, for benchmarking and
+testing mak_from_titles offline. The stub parses the OR-query of titles,
+and returns a matching entity for a fraction match_rate of them (chosen
+deterministically by title), truncated to the requested count.
+
+Usage:
+
+    server,api_url = serve_mak_stub()
+    data = mak_from_titles(raw_titles,call_limit,api_url=api_url)
+    server.shutdown()
+'''
+
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+class _ThreadingHTTPServer(ThreadingMixIn,HTTPServer):
+    '''As http.server.ThreadingHTTPServer, which needs Python 3.7'''
+    daemon_threads = True
+
+def _make_handler(match_rate,latency):
+    class MakStubHandler(BaseHTTPRequestHandler):
+        def log_message(self,*args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            query = parse_qs(body.decode("utf-8"))
+            count = int(query["count"][0])
+            titles = re.findall("Ti='([^']*)'",query["expr"][0])
+            entities = []
+            for title in titles:
+                # Deterministic choice of which titles match
+                if zlib.crc32(title.encode("utf-8")) % 1000 >= match_rate*1000:
+                    continue
+                entities.append(dict(Ti=title,CC=len(title) % 7,D="2017-01-01",
+                                     AA=[dict(AfN="university of "+title.split()[0])]))
+            out = json.dumps(dict(entities=entities[:count])).encode("utf-8")
+            if latency > 0:
+                time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type","application/json")
+            self.send_header("Content-Length",str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+    return MakStubHandler
+
+def serve_mak_stub(match_rate=0.9,latency=0.,port=0):
+    '''
+    Serve the stub from a background thread, returning the server (call
+    server.shutdown() when done) and the URL to pass as api_url.
+
+    match_rate: the fraction of titles to return a match for
+    latency: seconds to wait before each response, to mimic the network
+    '''
+    server = _ThreadingHTTPServer(("127.0.0.1",port),
+                                  _make_handler(match_rate,latency))
+    thread = threading.Thread(target=server.serve_forever,daemon=True)
+    thread.start()
+    return server,"http://127.0.0.1:%d/evaluate" % server.server_address[1]
@@ -0,0 +1,55 @@
+'''
+metrics
+~~~~~~~~~~~~~~~
+
+A collector for the instrumentation hooks of the toolbox. LatLonGetter,
+MakQueryEngine / mak_from_titles and AutoCompounder accept a metrics
+callback, which is called as metrics(name,value) at each stage, where:
+
+    * names ending in "_seconds" are timings of a stage
+    * all other names are counts (e.g. exact, fuzzy and memoised matches,
+      or API calls and retries)
+
+and names are prefixed by the tool, e.g. "latlon.scoring_seconds" or
+"mak.retries". Any function with this signature can be passed instead,
+e.g. to forward the metrics to a monitoring service. If no callback is
+given (the default) nothing is collected.
+
+Usage:
+
+    metrics = Metrics()
+    llg = LatLonGetter(grid_path,scorer,metrics=metrics)
+    llg.process_latlons(mak_institutes)
+    metrics.report()
+'''
+
+import threading
+from collections import defaultdict
+
+class Metrics:
+    '''Accumulates the total value and the number of calls for each
+    name, and is safe to share between threads'''
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def __call__(self,name,value=1):
+        with self._lock:
+            self.totals[name] += value
+            self.calls[name] += 1
+
+    def summary(self):
+        '''Returns a dict of name --> (total value,number of calls)'''
+        with self._lock:
+            return {name:(self.totals[name],self.calls[name])
+                    for name in sorted(self.totals)}
+
+    def report(self):
+        '''Print the totals, with the mean per call for timings'''
+        for name,(total,calls) in self.summary().items():
+            if name.endswith("_seconds"):
+                print("%-45s %10.3fs in %d calls (%.2gs per call)" %
+                      (name,total,calls,total/calls))
+            else:
+                print("%-45s %10d" % (name,total))
@@ -1,9 +1,343 @@
-from tqdm import tqdm
-import pandas as pd
 import numpy as np
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process as fuzzy_proc
 from os.path import join as pjoin
+from multiprocessing import Pool
+from itertools import chain
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+'''Version of the compiled GRID format: bump this if the format changes'''
+COMPILED_VERSION = 2
+'''The GRID tables read by LatLonGetter, relative to the GRID path'''
+GRID_TABLES = ["grid.csv","full_tables/addresses.csv","full_tables/aliases.csv"]
+
+def _is_null(value):
+    '''As pandas.isnull, for a single value: None or NaN'''
+    return value is None or (isinstance(value,float) and value != value)
+
+def _char_ngrams(text,n):
+    '''Set of character n-grams of text, padded so that word
+    boundaries also form n-grams'''
+    padded = " "+text+" "
+    return {padded[i:i+n] for i in range(max(len(padded)-n+1,1))}
+
+'''
+Inverted index of character n-grams, for shortlisting candidate
+names before running a (slow) fuzzy scorer over them. The postings
+are stored as flat arrays (with offsets per n-gram) so that they can
+be saved to, and memory-mapped from, disk.
+'''
+class NgramIndex:
+    def __init__(self,names,ngram_size=3):
+        postings = {}
+        n_grams = np.zeros(len(names),dtype=np.int32)
+        for idx,name in enumerate(names):
+            grams = _char_ngrams(name.lower(),ngram_size)
+            n_grams[idx] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram,[]).append(idx)
+        grams = list(postings)
+        offsets = np.zeros(len(grams)+1,dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[g]) for g in grams])
+        flat = np.fromiter(chain.from_iterable(postings[g] for g in grams),
+                           dtype=np.int32,count=offsets[-1])
+        self._setup(names,ngram_size,grams,offsets,flat,n_grams)
+
+    @classmethod
+    def from_arrays(cls,names,ngram_size,grams,offsets,postings,n_grams):
+        '''Recreate an index from the output of to_arrays'''
+        index = cls.__new__(cls)
+        index._setup(names,ngram_size,grams,offsets,postings,n_grams)
+        return index
+
+    def _setup(self,names,ngram_size,grams,offsets,postings,n_grams):
+        self.names = names
+        self.ngram_size = ngram_size
+        self.grams = {gram:row for row,gram in enumerate(grams)}
+        self.offsets = offsets
+        self.postings = postings
+        self.n_grams = n_grams
+
+    def to_arrays(self):
+        '''Return the n-grams, and the arrays of offsets, postings and
+        n-gram counts'''
+        return list(self.grams),self.offsets,self.postings,self.n_grams
+
+    def candidates(self,query,n_candidates):
+        '''Return the n_candidates names sharing the most n-grams with
+        query, ranked by Dice coefficient'''
+        grams = _char_ngrams(query.lower(),self.ngram_size)
+        rows = [self.grams[g] for g in grams if g in self.grams]
+        if len(rows) == 0:
+            return []
+        hits = [self.postings[self.offsets[r]:self.offsets[r+1]] for r in rows]
+        shared = np.bincount(np.concatenate(hits),minlength=len(self.names))
+        dice = 2*shared/(len(grams) + self.n_grams)
+        # Only keep names with at least one n-gram in common
+        n_hit = np.count_nonzero(shared)
+        if n_hit > n_candidates:
+            top = np.argpartition(-dice,n_candidates)[:n_candidates]
+        else:
+            top = np.flatnonzero(shared)
+        top = top[np.argsort(-dice[top],kind="mergesort")]
+        return [self.names[idx] for idx in top]
+
+def _name_hash(text):
+    '''64-bit hash of text, which (unlike hash) is the same in every process'''
+    digest = hashlib.blake2b(text.encode("utf-8"),digest_size=8).digest()
+    return int.from_bytes(digest,"little",signed=True)
+
+'''
+Immutable sequence of strings, stored as a single UTF-8 buffer with
+offsets per string, rather than as one Python object per string. The
+arrays can be saved to, and memory-mapped from, disk.
+'''
+class StringTable:
+    def __init__(self,strings):
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded)+1,dtype=np.int64)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        buffer = np.frombuffer(b"".join(encoded),dtype=np.uint8)
+        self._setup(buffer,offsets)
+
+    @classmethod
+    def from_arrays(cls,buffer,offsets):
+        '''Recreate a table from the output of to_arrays'''
+        table = cls.__new__(cls)
+        table._setup(buffer,offsets)
+        return table
+
+    def _setup(self,buffer,offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def to_arrays(self):
+        '''Return the buffer and the array of offsets'''
+        return self.buffer,self.offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self,idx):
+        if idx < 0:
+            idx += len(self.offsets) - 1
+        start,end = self.offsets[idx],self.offsets[idx+1]
+        return self.buffer[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+'''
+Columnar store of the GRID data: the unique names (institute names, then
+aliases) in a StringTable, each referring to an institute by index, with
+float32 lat/lng and the GRID ID per institute. Exact (lowercase) name
+lookups go via a sorted array of name hashes. Everything is held in flat
+arrays, so the store is shared between forked worker processes (and
+memory-mapped from the compiled GRID) without copying.
+'''
+class GridStore:
+    '''The names of the arrays, as returned by to_arrays'''
+    ARRAYS = ["names_buffer","names_offsets","institute","lat","lng",
+              "grid_ids_buffer","grid_ids_offsets","value_idx",
+              "hashes","hash_order"]
+
+    def __init__(self,names,institute,lat,lng,grid_ids,value_idx):
+        '''
+        names, grid_ids: StringTables of the unique names and the GRID ID
+                         of each institute
+        institute: The institute index of each name
+        lat, lng: The location of each institute
+        value_idx: The original names + aliases (as indexes of names)
+        '''
+        hashes = np.fromiter((_name_hash(name.lower()) for name in names),
+                             dtype=np.int64,count=len(names))
+        # Stable, so that the first of any names with the same lowercase
+        # form comes first
+        order = np.argsort(hashes,kind="mergesort").astype(np.int32)
+        self._setup(names,institute,lat,lng,grid_ids,value_idx,
+                    hashes[order],order)
+
+    @classmethod
+    def from_arrays(cls,arrays):
+        '''Recreate a store from the output of to_arrays'''
+        store = cls.__new__(cls)
+        store._setup(StringTable.from_arrays(arrays["names_buffer"],
+                                             arrays["names_offsets"]),
+                     arrays["institute"],arrays["lat"],arrays["lng"],
+                     StringTable.from_arrays(arrays["grid_ids_buffer"],
+                                             arrays["grid_ids_offsets"]),
+                     arrays["value_idx"],arrays["hashes"],arrays["hash_order"])
+        return store
+
+    def _setup(self,names,institute,lat,lng,grid_ids,value_idx,
+               hashes,hash_order):
+        self.names = names
+        self.institute = institute
+        self.lat = lat
+        self.lng = lng
+        self.grid_ids = grid_ids
+        self.value_idx = value_idx
+        self.hashes = hashes
+        self.hash_order = hash_order
+
+    def to_arrays(self):
+        '''Return a dict of the arrays, named as in ARRAYS'''
+        names_buffer,names_offsets = self.names.to_arrays()
+        grid_ids_buffer,grid_ids_offsets = self.grid_ids.to_arrays()
+        return dict(names_buffer=names_buffer,names_offsets=names_offsets,
+                    institute=self.institute,lat=self.lat,lng=self.lng,
+                    grid_ids_buffer=grid_ids_buffer,
+                    grid_ids_offsets=grid_ids_offsets,
+                    value_idx=self.value_idx,hashes=self.hashes,
+                    hash_order=self.hash_order)
+
+    def _lookup(self,lowered,name=None):
+        '''Index and name of the first name whose lowercase form is
+        lowered (and which is name, if given), or None'''
+        hashed = _name_hash(lowered)
+        pos = int(np.searchsorted(self.hashes,hashed))
+        while pos < len(self.hashes) and self.hashes[pos] == hashed:
+            idx = int(self.hash_order[pos])
+            _name = self.names[idx]
+            if _name.lower() == lowered and name in (None,_name):
+                return idx,_name
+            pos += 1
+        return None
+
+    def exact_match(self,text):
+        '''Index and name of the first name which, in lowercase, is
+        text, or None'''
+        if not isinstance(text,str):
+            return None
+        return self._lookup(text)
+
+    def find(self,name):
+        '''Index of name, or None'''
+        found = self._lookup(name.lower(),name)
+        return None if found is None else found[0]
+
+    def lat_lng(self,idx):
+        '''(lat,lng) of the institute of the idx-th name'''
+        institute = self.institute[idx]
+        return float(self.lat[institute]),float(self.lng[institute])
+
+    def location(self,idx):
+        '''(lat,lng,GRID ID) of the institute of the idx-th name'''
+        return self.lat_lng(idx)+(self.grid_ids[self.institute[idx]],)
+
+def _read_grid(grid_path):
+    '''Read and join the GRID tables into a GridStore, of the unique
+    names (Names before aliases) with their institutes' locations, and
+    the position of each of the original names + aliases in the unique
+    names'''
+    import pandas as pd
+    grid_full,grid_address,grid_alias = [pd.read_csv(pjoin(grid_path,table),
+                                                     low_memory=False)
+                                         for table in GRID_TABLES]
+    # Join the dataframes
+    grid_df = grid_full.join(grid_address.set_index(keys=["grid_id"]),on="ID")
+    grid_df = grid_df.join(grid_alias.set_index(keys=["grid_id"]),on="ID")
+    grid_df = grid_df[["Name","lat","lng","ID","alias"]]
+
+    # Generate the list of names + not null aliases
+    null_alias = pd.isnull(grid_df.alias)
+    all_values = list(grid_df.Name.values) + list(grid_df.alias.values[~null_alias])
+    # Keep the first institute for each name (Names take precedence),
+    # and the first location for each institute
+    names = {}
+    institutes = {}
+    for col in ("Name","alias"):
+        for name,lat,lon,grid_id in zip(grid_df[col].values,
+                                        grid_df.lat.values,
+                                        grid_df.lng.values,
+                                        grid_df.ID.values):
+            if pd.isnull(name) or name in names:
+                continue
+            institutes.setdefault(grid_id,(lat,lon))
+            names[name] = grid_id
+    positions = {name:idx for idx,name in enumerate(names)}
+    institute_idx = {grid_id:idx for idx,grid_id in enumerate(institutes)}
+    lat,lng = zip(*institutes.values())
+    return GridStore(StringTable(names),
+                     np.array([institute_idx[grid_id] for grid_id in names.values()],
+                              dtype=np.int32),
+                     np.array(lat,dtype=np.float32),np.array(lng,dtype=np.float32),
+                     StringTable(institutes),
+                     np.array([positions[v] for v in all_values],dtype=np.int32))
+
+def _grid_release_key(grid_path,ngram_size):
+    '''Identify a GRID release by its directory name and the size and
+    modification time of its tables'''
+    grid_path = os.path.normpath(os.path.expanduser(grid_path))
+    stamp = [COMPILED_VERSION,ngram_size]
+    for table in GRID_TABLES:
+        stat = os.stat(pjoin(grid_path,table))
+        stamp += [table,stat.st_size,int(stat.st_mtime)]
+    digest = hashlib.sha1(json.dumps(stamp).encode("utf-8")).hexdigest()
+    return os.path.basename(grid_path)+"-"+digest[:12]
+
+def compile_grid(grid_path,cache_dir,ngram_size=3):
+    '''
+    Compile the GRID release at grid_path (GridStore and n-gram index)
+    into a directory of .npy files under cache_dir, unless this has
+    already been done for this release. Returns the path of the
+    compiled directory, which can be loaded with load_compiled_grid.
+    '''
+    out_path = pjoin(cache_dir,"grid-"+_grid_release_key(grid_path,ngram_size))
+    if os.path.isdir(out_path):
+        return out_path
+    store = _read_grid(os.path.expanduser(grid_path))
+    grams,offsets,postings,n_grams = NgramIndex(store.names,ngram_size).to_arrays()
+    grams_buffer,grams_offsets = StringTable(grams).to_arrays()
+    arrays = dict(store.to_arrays(),grams_buffer=grams_buffer,
+                  grams_offsets=grams_offsets,offsets=offsets,
+                  postings=postings,n_grams=n_grams)
+    # Write to a temporary directory, then move into place
+    os.makedirs(cache_dir,exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=cache_dir)
+    for name,array in arrays.items():
+        np.save(pjoin(tmp_path,name+".npy"),array)
+    try:
+        os.rename(tmp_path,out_path)
+    # Another process got there first
+    except OSError:
+        shutil.rmtree(tmp_path)
+    return out_path
+
+def load_compiled_grid(path,ngram_size=3):
+    '''Load the output of compile_grid, memory-mapping the arrays.
+    Returns the GridStore and the NgramIndex'''
+    # As plain arrays (backed by the memory maps), since indexing
+    # np.memmap objects is slow
+    arrays = {name:np.asarray(np.load(pjoin(path,name+".npy"),mmap_mode="r"))
+              for name in GridStore.ARRAYS+["grams_buffer","grams_offsets",
+                                            "offsets","postings","n_grams"]}
+    store = GridStore.from_arrays(arrays)
+    grams = StringTable.from_arrays(arrays["grams_buffer"],arrays["grams_offsets"])
+    index = NgramIndex.from_arrays(store.names,ngram_size,list(grams),
+                                   arrays["offsets"],arrays["postings"],
+                                   arrays["n_grams"])
+    return store,index
+
+def _scorer_key(scorer):
+    '''Identify a scorer by name, including the fuzzers of a ComboFuzzer.
+    Returns None if any of these has no stable name (e.g. lambdas, nested
+    functions and functools.partial objects)'''
+    funcs = [scorer]
+    owner = getattr(scorer,"__self__",None)
+    if isinstance(owner,ComboFuzzer):
+        funcs += owner.fuzzers
+    parts = []
+    for func in funcs:
+        qualname = getattr(func,"__qualname__",None)
+        if qualname is None or "<" in qualname:
+            return None
+        parts.append(getattr(func,"__module__","")+"."+qualname)
+    return ",".join(parts)
 
 '''Combine fuzzy scores from different scorers'''
 class ComboFuzzer:
@@ -20,86 +354,307 @@ class ComboFuzzer:
             _score += _raw_score**2
         return np.sqrt(_score)*self.norm
 
+    def combo_fuzz_many(self,target,candidates,score_cutoff=None):
+        '''
+        Score target against each of candidates in bulk, returning an
+        array of scores identical to those from combo_fuzz.
+
+        score_cutoff: If set, candidates which can no longer reach this
+                      score are not passed to the remaining fuzzers,
+                      and (like any others below it) are scored as 0.
+        '''
+        candidates = list(candidates)
+        _score = np.zeros(len(candidates))
+        alive = np.arange(len(candidates))
+        for i,_fuzz in enumerate(self.fuzzers):
+            _raw_score = np.fromiter((_fuzz(target,candidates[j]) for j in alive),
+                                     dtype=np.float64,count=len(alive))/100
+            _score[alive] += _raw_score**2
+            if score_cutoff is not None:
+                # Each of the remaining fuzzers contributes at most 1
+                n_left = len(self.fuzzers) - i - 1
+                bound = np.sqrt(_score[alive] + n_left)*self.norm
+                alive = alive[bound >= score_cutoff]
+        scores = np.sqrt(_score)*self.norm
+        if score_cutoff is not None:
+            rejected = np.ones(len(candidates),dtype=bool)
+            rejected[alive] = False
+            scores[rejected | (scores < score_cutoff)] = 0
+        return scores
+
+    def combo_fuzz_matrix(self,targets,candidates,score_cutoff=None):
+        '''Score each of targets against each of candidates, returning a
+        matrix of shape (len(targets), len(candidates))'''
+        candidates = list(candidates)
+        scores = np.zeros((len(targets),len(candidates)))
+        for i,target in enumerate(targets):
+            scores[i] = self.combo_fuzz_many(target,candidates,score_cutoff)
+        return scores
+
 '''
 Get the Lat/Lon from GRID data by fuzzy matching institute names
 '''
 class LatLonGetter:
-    def __init__(self,grid_path,scorer):
+    '''
+    grid_path: Path to the unzipped GRID release
+    scorer: Fuzzy scorer to apply to shortlisted candidates
+    n_candidates: Number of candidates shortlisted by the n-gram index
+                  for each fuzzy match. Larger values improve recall at
+                  the expense of speed. None scores every GRID name.
+    ngram_size: Character n-gram size used by the candidate index
+    cache_dir: If set, the GRID data are compiled once per release into
+               this directory, and memory-mapped from there thereafter
+    cache_fuzzy: Persist fuzzy matches to cache_dir (per GRID release,
+                 scorer and n_candidates), to be reused across runs
+    scorer_key: Name identifying the scorer in the fuzzy match cache,
+                which is required if the scorer (or any fuzzer of a
+                ComboFuzzer) has no stable name, e.g. a lambda or
+                functools.partial. Change it whenever the scorer changes.
+    metrics: Optional callback, called as metrics(name,value) with the
+             timings of each stage (load_grid, build_index, candidates,
+             scoring) and counts of exact, memo and fuzzy matches
+    '''
+    def __init__(self,grid_path,scorer,n_candidates=100,ngram_size=3,
+                 cache_dir=None,cache_fuzzy=False,scorer_key=None,
+                 metrics=None):
         self.scorer = scorer
-        # Read the GRID data
-        grid_full = pd.read_csv(pjoin(grid_path,"grid.csv"),low_memory=False)
-        grid_address = pd.read_csv(pjoin(grid_path,"full_tables/addresses.csv"),low_memory=False)
-        grid_alias = pd.read_csv(pjoin(grid_path,"full_tables/aliases.csv"),low_memory=False)
-        # Join the dataframes
-        grid_df = grid_full.join(grid_address.set_index(keys=["grid_id"]),on="ID")
-        grid_df = grid_df.join(grid_alias.set_index(keys=["grid_id"]),on="ID")
-        grid_df = grid_df[["Name","lat","lng","ID","alias"]]
-        
-        # Find the null aliases
-        self.df = grid_df
-        null_alias = pd.isnull(self.df.alias)
-        not_null = self.df.loc[~null_alias]
-        # Now generate the list of names + not null aliases
-        alias_names = list(not_null.alias.values)
-        std_names = list(grid_df.Name.values)
-        self.all_possible_values = std_names + alias_names
-        self.lower_possible_values = [x.lower() for x in
-                                      self.all_possible_values]
+        self.n_candidates = n_candidates
+        self.metrics = metrics
+        self.ngram_size = ngram_size
+        # Read the GRID data, either directly or via the compiled cache
+        start = time.perf_counter()
+        self.compiled_path = None
+        if cache_dir is None:
+            self.store = _read_grid(grid_path)
+            self._emit("latlon.load_grid_seconds",time.perf_counter()-start)
+            start = time.perf_counter()
+            self.index = NgramIndex(self.store.names,ngram_size=ngram_size)
+            self._emit("latlon.build_index_seconds",time.perf_counter()-start)
+        else:
+            self.compiled_path = compile_grid(grid_path,cache_dir,ngram_size)
+            self.store,self.index = load_compiled_grid(self.compiled_path,
+                                                       ngram_size)
+            self._emit("latlon.load_grid_seconds",time.perf_counter()-start)
+        self._all_possible_values = None
+
+        # Reload any previous fuzzy matches for this release and scorer
         self.fuzzy_matches = {}
+        # Names fuzzy matched (and counted) by the worker pool, but
+        # not yet looked up by get_latlon
+        self._pool_matched = set()
+        self.fuzzy_cache_path = None
+        if cache_fuzzy:
+            if cache_dir is None:
+                raise ValueError("cache_fuzzy requires a cache_dir")
+            if scorer_key is None:
+                scorer_key = _scorer_key(scorer)
+            if scorer_key is None:
+                raise ValueError("cache_fuzzy requires a scorer_key for "
+                                 "scorers without a stable name: %r" % scorer)
+            key = json.dumps([os.path.basename(self.compiled_path),
+                              scorer_key,n_candidates])
+            digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            self.fuzzy_cache_path = pjoin(cache_dir,"fuzzy-"+digest[:12]+".json")
+            if os.path.exists(self.fuzzy_cache_path):
+                with open(self.fuzzy_cache_path) as f:
+                    self.fuzzy_matches = {k:tuple(v) for k,v in json.load(f).items()}
+
+    def __getstate__(self):
+        '''When memory-mapped from a compiled GRID, the store and index
+        are pickled by path, so that worker processes map the same files
+        rather than receiving copies'''
+        state = dict(self.__dict__,_all_possible_values=None)
+        if self.compiled_path is not None:
+            del state["store"],state["index"]
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if "store" not in state:
+            self.store,self.index = load_compiled_grid(self.compiled_path,
+                                                       self.ngram_size)
+
+    @property
+    def all_possible_values(self):
+        '''The original GRID names + aliases, built on first use'''
+        if self._all_possible_values is None:
+            names = self.store.names
+            self._all_possible_values = [names[idx] for idx
+                                         in self.store.value_idx.tolist()]
+        return self._all_possible_values
+
+    def _emit(self,name,value=1):
+        '''Pass a timing or count to the metrics callback, if any'''
+        if self.metrics is not None:
+            self.metrics(name,value)
+
+    def save_fuzzy_matches(self):
+        '''Write the fuzzy matches to the persistent cache, if enabled'''
+        if self.fuzzy_cache_path is None:
+            return
+        matches = {k:(match,float(score)) for k,(match,score)
+                   in self.fuzzy_matches.items() if isinstance(k,str)}
+        tmp_path = self.fuzzy_cache_path+".tmp"
+        with open(tmp_path,"w") as f:
+            json.dump(matches,f)
+        os.replace(tmp_path,self.fuzzy_cache_path)
+
+    def _fuzzy_match(self,mak_name):
+        '''Fuzzy match mak_name against the shortlisted GRID names,
+        falling back to all GRID names if none of the shortlist is
+        a plausible match (e.g. for short names and acronyms)'''
+        from fuzzywuzzy import process as fuzzy_proc
+        start = time.perf_counter()
+        choices = []
+        if self.n_candidates is not None:
+            choices = self.index.candidates(mak_name,self.n_candidates)
+        shortlisted = time.perf_counter()
+        filtered = []
+        if len(choices) > 0:
+            results = fuzzy_proc.extract(mak_name,choices)
+            filtered = [r for r,s in results if s > 50]
+        if len(filtered) == 0:
+            results = fuzzy_proc.extract(mak_name,self.all_possible_values)
+            filtered = [r for r,s in results if s > 50]
+        match = self._best_match(mak_name,filtered)
+        self._emit("latlon.candidates_seconds",shortlisted-start)
+        self._emit("latlon.scoring_seconds",time.perf_counter()-shortlisted)
+        return match
+
+    def _best_match(self,mak_name,choices):
+        '''As fuzzy_proc.extractOne with self.scorer, but scoring all of
+        choices in bulk if the scorer is a ComboFuzzer.combo_fuzz'''
+        from fuzzywuzzy import process as fuzzy_proc
+        from fuzzywuzzy.utils import full_process
+        if len(choices) == 0:
+            return None
+        owner = getattr(self.scorer,"__self__",None)
+        if (not isinstance(owner,ComboFuzzer) or
+            getattr(self.scorer,"__func__",None) is not ComboFuzzer.combo_fuzz):
+            return fuzzy_proc.extractOne(query=mak_name,choices=choices,
+                                         scorer=self.scorer)
+        # Process the inputs as extractOne does, and (as max) take
+        # the first of any tied best scores
+        scores = owner.combo_fuzz_many(full_process(mak_name),
+                                       [full_process(c) for c in choices])
+        best = int(np.argmax(scores))
+        return choices[best],scores[best]
 
     def get_latlon(self,mak_name,perfect_only=False):
         # Super-fast check to see if there is an exact match
-        try:
-            idx = self.lower_possible_values.index(mak_name)
-            match = self.all_possible_values[idx]
+        exact = self.store.exact_match(mak_name)
+        if exact is not None:
+            idx,match = exact
             score = 1.
+            if self.metrics is not None:
+                self.metrics("latlon.exact",1)
         # Otherwise, fuzzy match
-        except ValueError:
+        else:
             if perfect_only:
+                if self.metrics is not None:
+                    self.metrics("latlon.unmatched",1)
                 return (None,None,None,0)
             # If already done a fuzzy match for this
-            if mak_name in self.fuzzy_matches:
+            if mak_name in self._pool_matched:
+                match,score = self.fuzzy_matches[mak_name]
+                self._pool_matched.discard(mak_name)
+            elif mak_name in self.fuzzy_matches:
                 match,score = self.fuzzy_matches[mak_name]
+                if self.metrics is not None:
+                    self.metrics("latlon.memo",1)
             # Otherwise, do the fuzzy match
             else:
-                results = fuzzy_proc.extract(mak_name,self.all_possible_values)
-                filtered = [r for r,s in results if s > 50]
-                match,score = fuzzy_proc.extractOne(query=mak_name,
-                                                    choices=filtered,
-                                                    scorer=self.scorer)
+                match,score = self._fuzzy_match(mak_name)
+                if self.metrics is not None:
+                    self.metrics("latlon.fuzzy",1)
+            idx = self.store.find(match)
         self.fuzzy_matches[mak_name] = (match,score)
 
-        # Check whether the match was a Name or alias
-        condition = self.df.Name == match
-        if condition.sum() == 0:
-            condition = self.df.alias == match
-
-        _df = self.df.loc[condition]
         # Get the lat/lon
-        lat = _df["lat"].values[0]
-        lon = _df["lng"].values[0]
+        lat,lon = self.store.lat_lng(idx)
         return (lat,lon,match,score)
     
-    def process_latlons(self,mak_institutes,perfect_only=False):
-        isnull = pd.isnull(mak_institutes)
-        if type(isnull) is bool:
-            if isnull:
-                return []
-        elif all(isnull):
+    def process_latlons(self,mak_institutes,perfect_only=False,
+                        workers=1,chunksize=100):
+        '''
+        Get the (lat,lon,match,score) for each of mak_institutes.
+
+        workers: Number of processes over which to spread the fuzzy
+                 matching. Each unique name is only matched once, and
+                 the results are merged into self.fuzzy_matches.
+        chunksize: Number of names sent to a worker at a time
+        '''
+        from tqdm import tqdm
+        if _is_null(mak_institutes):
             return []
+        if not isinstance(mak_institutes,str):
+            mak_institutes = list(mak_institutes)
+            if all(_is_null(mak_name) for mak_name in mak_institutes):
+                return []
+        if workers > 1 and not perfect_only:
+            self._parallel_fuzzy_match(mak_institutes,workers,chunksize)
         results = []        
         for mak_name in tqdm(mak_institutes):
             results.append(self.get_latlon(mak_name,perfect_only))
+        self.save_fuzzy_matches()
         return results
 
+    def _parallel_fuzzy_match(self,mak_institutes,workers,chunksize):
+        '''Fill self.fuzzy_matches for any unmatched names, using a pool
+        of processes which each hold a single copy of this object'''
+        todo = [mak_name for mak_name in dict.fromkeys(mak_institutes)
+                if self.store.exact_match(mak_name) is None
+                and mak_name not in self.fuzzy_matches]
+        if len(todo) == 0:
+            return
+        from tqdm import tqdm
+        # The metrics callback stays in this process, since it may not
+        # be picklable, so the workers pass back the timings of each match
+        metrics,self.metrics = self.metrics,None
+        start = time.perf_counter()
+        try:
+            # Under "fork" the initargs are inherited rather than pickled,
+            # otherwise they are pickled once per worker (not per task)
+            with Pool(workers,initializer=_init_worker,initargs=(self,)) as pool:
+                matches = pool.imap(_fuzzy_match_worker,todo,chunksize=chunksize)
+                for mak_name,(match,timings) in zip(todo,tqdm(matches,total=len(todo))):
+                    self.fuzzy_matches[mak_name] = match
+                    self._pool_matched.add(mak_name)
+                    if metrics is not None:
+                        for name,value in timings:
+                            metrics(name,value)
+                        metrics("latlon.fuzzy",1)
+        finally:
+            self.metrics = metrics
+        self._emit("latlon.parallel_fuzzy_seconds",time.perf_counter()-start)
+        self._emit("latlon.parallel_fuzzy",len(todo))
+
+'''The LatLonGetter shared by each worker process, and the timings
+collected from it for the current match'''
+_worker_getter = None
+_worker_timings = []
+
+def _init_worker(getter):
+    global _worker_getter
+    _worker_getter = getter
+    _worker_getter.metrics = lambda name,value=1: _worker_timings.append((name,value))
+
+def _fuzzy_match_worker(mak_name):
+    del _worker_timings[:]
+    match = _worker_getter._fuzzy_match(mak_name)
+    return match,list(_worker_timings)
+
 '''
 Wrapper method: just pass a list of institutes from MAK
 and the path to the GRID data.
 '''
-def lat_lon_from_mak_names(mak_institutes,grid_path,perfect_only=False):
+def lat_lon_from_mak_names(mak_institutes,grid_path,perfect_only=False,
+                           workers=1,metrics=None):
+    from fuzzywuzzy import fuzz
     cf = ComboFuzzer([fuzz.token_sort_ratio,fuzz.partial_ratio])
-    llg = LatLonGetter(grid_path=grid_path,scorer=cf.combo_fuzz)    
-    return llg.process_latlons(mak_institutes,perfect_only)
+    llg = LatLonGetter(grid_path=grid_path,scorer=cf.combo_fuzz,
+                       metrics=metrics)
+    return llg.process_latlons(mak_institutes,perfect_only,workers=workers)
 
 if __name__ == "__main__":
     mak_institutes = ["united arab emirates university","university of sharjah","masdar institute of science and technology",
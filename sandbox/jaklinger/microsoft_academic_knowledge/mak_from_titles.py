@@ -16,6 +16,31 @@ Usage:
           raw_titles: list of pairs (ID, raw_title) 
           call_limit: integer maximum number of calls to API
 
+    Optionally, queries can be posted concurrently, with a rate limit:
+
+    mak_from_titles(raw_titles,call_limit,concurrency=4,calls_per_second=2)
+
+    and results (including confirmed misses) can be cached between runs,
+    so that titles are only ever looked up once:
+
+    mak_from_titles(raw_titles,call_limit,cache_path="mak-cache.db")
+
+    Timings (API round trips, throttling) and counts (calls, retries,
+    batches by outcome, cache hits) can be collected by passing a
+    callback, e.g. a metrics.Metrics object:
+
+    mak_from_titles(raw_titles,call_limit,metrics=metrics)
+
+    For very large inputs, stream_mak_from_titles accepts any iterable of
+    (ID, raw_title) pairs, yields results per batch, appends them to a
+    JSON-lines file and can be resumed (given the same input order) from a
+    checkpoint of the input position reached:
+
+    for records in stream_mak_from_titles(raw_titles,call_limit,
+                                          output_path="MAK-matched.jsonl",
+                                          checkpoint_path="MAK-checkpoint.json"):
+        ...
+
 Returns:
 
     data: a dict containing
@@ -29,8 +54,16 @@ Returns:
 
 # Imports
 from alphabet_detector import AlphabetDetector
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, namedtuple
+from itertools import islice
+from multiprocessing import Pool
+import sqlite3
+import threading
+import time
 import json
+import os
+import re
 
 # Editable parameters
 '''Inputs for the MAK POST request, including the API key'''
@@ -46,89 +79,518 @@ NB: Don't edit these just yet, the code relies on these specific values.
 FIELDS = ["Id","Ti","D","AA.AuN","AA.AuId","F.FId",
           "J.JId","AA.AfId","CC","ECC","AA.AfN","J.JN"]
 
+'''
+Batching of titles into queries: a hard limit of TITLE_COUNT titles and
+MAX_QUERY_BYTES (encoded) per query, returning QUERY_COUNT results. Batches
+are sized so that the expected number of results is no more than
+RESULT_HEADROOM * QUERY_COUNT.
+'''
+TITLE_COUNT = 1000
+MAX_QUERY_BYTES = 64000
+QUERY_COUNT = 1000
+RESULT_HEADROOM = 0.9
+
+'''The MAK evaluate endpoint (override this to test against a local server)'''
+API_URL = 'https://westus.api.cognitive.microsoft.com/academic/v1.0/evaluate'
+
+'''Status codes meaning that a query was too large, so should be split'''
+REJECT_STATUSES = (400,413,414)
+
+'''Retry policy: status codes to retry, the maximum number of retries per
+query and the initial backoff in seconds (doubled on each retry)'''
+RETRY_STATUSES = (429,500,502,503,504)
+MAX_RETRIES = 5
+BACKOFF = 1.
+
 # Class definitions
+class CallLimitReached(Exception):
+    '''Raised when a query can't be posted without exceeding the call limit'''
+    pass
+
+class QueryRejected(Exception):
+    '''Raised when MAK rejects a query (e.g. for being too large)'''
+    def __init__(self,status_code):
+        super().__init__("Query rejected with status code "+str(status_code))
+        self.status_code = status_code
+
+'''The outcome of a posted query: the JSON (None if the query was
+rejected) and the latency in seconds'''
+MakResponse = namedtuple("MakResponse",["js","latency"])
+
+class TokenBucket:
+    '''Thread-safe token bucket, allowing up to <rate> calls per second
+    on average, with bursts of up to <capacity> calls.'''
+    def __init__(self,rate,capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''Block until a token is available, and then take it'''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.last)*self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens)/self.rate
+            time.sleep(wait)
+
+class MakQueryEngine:
+    '''
+    Posts queries to MAK over a pooled HTTP session, optionally from
+    several threads at once. Every post (including retries) counts
+    towards call_limit, and is subject to the rate limit.
+
+    call_limit: The maximum number of posts to make
+    concurrency: The number of queries in flight at once
+    calls_per_second: Rate limit on posts (None for no limit)
+    api_url: The MAK evaluate endpoint
+    metrics: Optional callback, called as metrics(name,value) with the
+             timing of each round trip and counts of calls and retries
+    '''
+    def __init__(self,call_limit,concurrency=1,calls_per_second=None,
+                 api_url=API_URL,headers=HEADERS,max_retries=MAX_RETRIES,
+                 backoff=BACKOFF,metrics=None):
+        self.call_limit = call_limit
+        self.concurrency = concurrency
+        self.api_url = api_url
+        self.headers = headers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.metrics = metrics
+        self.bucket = None
+        if calls_per_second is not None:
+            self.bucket = TokenBucket(calls_per_second,capacity=concurrency)
+        # Book-keeping
+        self.calls = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+        # Keep one connection alive per thread (requests is only imported
+        # here, since it's slow to import and not needed for processing)
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,pool_maxsize=concurrency)
+        self.session.mount("http://",adapter)
+        self.session.mount("https://",adapter)
+
+    def _emit(self,name,value=1):
+        '''Pass a timing or count to the metrics callback, if any'''
+        if self.metrics is not None:
+            self.metrics(name,value)
+
+    def _take_call(self):
+        with self.lock:
+            if self.calls >= self.call_limit:
+                raise CallLimitReached()
+            self.calls += 1
+        self._emit("mak.calls")
+        if self.bucket is not None:
+            start = time.perf_counter()
+            self.bucket.acquire()
+            self._emit("mak.throttle_seconds",time.perf_counter()-start)
+
+    def post(self,query):
+        '''Post a single query, retrying with exponential backoff on
+        "retryable" statuses or non-JSON responses. Returns the JSON.'''
+        for attempt in range(self.max_retries+1):
+            self._take_call()
+            start = time.perf_counter()
+            r = self.session.post(self.api_url,data=query.encode("utf-8"),
+                                  headers=self.headers)
+            self._emit("mak.round_trip_seconds",time.perf_counter()-start)
+            if r.status_code in REJECT_STATUSES:
+                self._emit("mak.rejected")
+                raise QueryRejected(r.status_code)
+            if r.status_code not in RETRY_STATUSES:
+                try:
+                    return r.json()
+                except ValueError as err:
+                    self._emit("mak.bad_responses")
+                    if attempt == self.max_retries:
+                        raise err
+            elif attempt == self.max_retries:
+                r.raise_for_status()
+            # Wait before retrying, respecting the server's wishes if given
+            wait = self.backoff*(2**attempt)
+            retry_after = r.headers.get("Retry-After","")
+            if retry_after.isdigit():
+                wait = max(wait,int(retry_after))
+            with self.lock:
+                self.retries += 1
+            self._emit("mak.retries")
+            time.sleep(wait)
+
+    def post_response(self,query):
+        '''Post a query, returning a MakResponse, or None if the query
+        wasn't posted due to the call limit'''
+        start = time.monotonic()
+        try:
+            js = self.post(query)
+        except CallLimitReached:
+            return None
+        except QueryRejected:
+            js = None
+        return MakResponse(js,time.monotonic()-start)
+
+    def imap(self,jobs):
+        '''
+        Lazily post queries from jobs, an iterable of (payload, query)
+        pairs, yielding (payload, MakResponse) in order. The response is
+        None if the query is None, or wasn't posted due to the call
+        limit. Only a few queries per thread are taken from jobs ahead
+        of the results being consumed.
+        '''
+        if self.concurrency <= 1:
+            for payload,query in jobs:
+                if query is None:
+                    yield payload,None
+                else:
+                    yield payload,self.post_response(query)
+            return
+        window = deque()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            for payload,query in jobs:
+                future = None
+                if query is not None:
+                    future = executor.submit(self.post_response,query)
+                window.append((payload,future))
+                while len(window) > 2*self.concurrency:
+                    payload,future = window.popleft()
+                    yield payload,(None if future is None else future.result())
+            while window:
+                payload,future = window.popleft()
+                yield payload,(None if future is None else future.result())
+
+class _CharTable(dict):
+    '''Translation table for str.translate, which classifies each
+    codepoint on first use: alphabetic (in any alphabet) and numeric
+    characters are kept, and anything else becomes a space.'''
+    def __init__(self,detector):
+        super().__init__()
+        self.detector = detector
+
+    def __missing__(self,codepoint):
+        x = chr(codepoint)
+        if len(self.detector.detect_alphabet(x)) > 0 or x.isnumeric():
+            self[codepoint] = x
+        else:
+            self[codepoint] = " "
+        return self[codepoint]
+
 class TitleProcessor(AlphabetDetector):
     '''Processes a pure utf-8 title into something ready for a MAK query.'''
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.char_table = _CharTable(self)
+        self.multi_space = re.compile("  +")
+
     def process_title(self,title):
         # Get replace non-alphanums (allowing foreign characters)
-        result = "".join([x
-                          if len(self.detect_alphabet(x)) > 0
-                          or x.isnumeric()
-                          else " " for x in title.lower()])
+        result = title.lower().translate(self.char_table)
         # Replace double-spaces with single-spaces
-        while "  " in result:
-            result = result.replace("  "," ")        
-        return result
+        return self.multi_space.sub(" ",result)
+
+    def process_titles(self,titles,workers=1,chunksize=1000):
+        '''Lazily process an iterable of titles, optionally spreading
+        the work over a pool of processes'''
+        if workers <= 1:
+            for title in titles:
+                yield self.process_title(title)
+            return
+        with Pool(workers) as pool:
+            yield from pool.imap(_process_title_worker,titles,
+                                 chunksize=chunksize)
+
+'''The TitleProcessor used by each worker process'''
+_worker_processor = None
+
+def _process_title_worker(title):
+    global _worker_processor
+    if _worker_processor is None:
+        _worker_processor = TitleProcessor()
+    return _worker_processor.process_title(title)
+
+class BatchPlanner:
+    '''
+    Packs titles into MAK OR-queries, limited by the encoded size of the
+    query and by the number of results expected back. The expected
+    number of results per title is updated from each complete response,
+    and statistics are recorded for every posted batch.
+
+    max_titles: Hard limit on the number of titles per query
+    max_bytes: Limit on the encoded size of a query
+    query_count: The number of results requested per query
+    headroom: Fraction of query_count that the expected results may fill
+    results_per_title: Initial guess of the results returned per title
+    '''
+    def __init__(self,max_titles=TITLE_COUNT,max_bytes=MAX_QUERY_BYTES,
+                 query_count=QUERY_COUNT,headroom=RESULT_HEADROOM,
+                 results_per_title=1.):
+        self.max_titles = max_titles
+        self.max_bytes = max_bytes
+        self.query_count = query_count
+        self.headroom = headroom
+        self.results_per_title = results_per_title
+        self.overhead = len(("expr=OR()&count="+str(query_count)+
+                             "&attributes="+",".join(FIELDS)).encode("utf-8"))
+        self.stats = []
+
+    def title_bytes(self,title):
+        '''The encoded size of a title in the query, including a comma'''
+        return len(("Ti='"+title+"',").encode("utf-8"))
+
+    def batch_titles(self):
+        '''The maximum number of titles per batch, given the expected
+        number of results per title'''
+        n_expected = int(self.query_count*self.headroom/self.results_per_title)
+        return max(1,min(self.max_titles,n_expected))
+
+    def pack(self,pending,final=False):
+        '''
+        Greedily pack (position, ID, title) triples into batches. Returns
+        the full batches and the remaining triples, unless final, in
+        which case the remaining triples also form a batch.
+        '''
+        max_titles = self.batch_titles()
+        batches = []
+        batch = []
+        size = self.overhead
+        for item in pending:
+            cost = self.title_bytes(item[-1])
+            if len(batch) > 0 and (size + cost > self.max_bytes or
+                                   len(batch) >= max_titles):
+                batches.append(batch)
+                batch = []
+                size = self.overhead
+            batch.append(item)
+            size += cost
+        if final and len(batch) > 0:
+            batches.append(batch)
+            batch = []
+        return batches,batch
+
+    def record(self,titles_subset,response):
+        '''Record statistics for a posted batch, and update the expected
+        number of results per title from complete responses'''
+        n_titles = len(titles_subset)
+        n_bytes = self.overhead + sum(self.title_bytes(t) for *_,t in titles_subset)
+        if response.js is None:
+            outcome,n_results = "rejected",None
+        else:
+            n_results = len(response.js["entities"])
+            outcome = "truncated" if n_results >= self.query_count else "ok"
+        if outcome == "ok":
+            observed = max(n_results/n_titles,0.01)
+            self.results_per_title = 0.8*self.results_per_title + 0.2*observed
+        self.stats.append(dict(titles=n_titles,bytes=n_bytes,results=n_results,
+                               latency=response.latency,outcome=outcome))
+        return outcome
+
+    def summary(self):
+        '''Print summary statistics of the posted batches'''
+        if len(self.stats) == 0:
+            return
+        n = len(self.stats)
+        outcomes = [row["outcome"] for row in self.stats]
+        print("Posted",n,"batches with on average",
+              round(sum(row["titles"] for row in self.stats)/n,1),"titles,",
+              round(sum(row["bytes"] for row in self.stats)/n),"bytes and",
+              round(sum(row["latency"] for row in self.stats)/n,3),
+              "seconds latency, of which",outcomes.count("truncated"),
+              "were truncated and",outcomes.count("rejected"),"rejected")
+
+class TitleCache:
+    '''
+    SQLite store of MAK results keyed by normalised title. Both matches
+    and confirmed misses are stored, so neither needs to be queried again.
+    '''
+    def __init__(self,path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS titles "
+                          "(title TEXT PRIMARY KEY, result TEXT)")
+
+    def lookup(self,titles,chunk_size=500):
+        '''Return a dict of title --> cached result for any of titles
+        which are in the cache'''
+        titles = list(set(titles))
+        found = {}
+        for offset in range(0,len(titles),chunk_size):
+            chunk = titles[offset:offset+chunk_size]
+            query = ("SELECT title, result FROM titles WHERE title IN "
+                     "("+",".join("?"*len(chunk))+")")
+            for title,result in self.conn.execute(query,chunk):
+                found[title] = json.loads(result)
+        return found
+
+    def store(self,results):
+        '''Store a dict of title --> result'''
+        self.conn.executemany("INSERT OR REPLACE INTO titles VALUES (?,?)",
+                              [(title,json.dumps(result))
+                               for title,result in results.items()])
+        self.conn.commit()
 
 # Function definitions
+def _make_query(titles_subset,query_count):
+    '''Generate the MAK query (OR statement of titles (Ti))'''
+    expr = ["Ti='"+t+"'" for *_,t in titles_subset]
+    expr = ','.join(expr)
+    expr = "expr=OR("+expr+")"
+    return expr+"&count="+str(query_count)+"&attributes="+",".join(FIELDS)
+
+def _iter_jobs(titles,cache,planner,call_limit):
+    '''
+    Turn (position, ID, title) triples into jobs for MakQueryEngine.imap:
+    results from the cache are passed straight through, and the remaining
+    titles are packed into queries, of which there are at most call_limit.
+    Once the limit is reached no more titles are read, since they can't
+    be queried (any cached results for them are found by the next run).
+    '''
+    titles = iter(titles)
+    batches = 0
+    pending = []
+    while True:
+        if batches >= call_limit:
+            break
+        block = list(islice(titles,planner.max_titles))
+        if len(block) == 0:
+            break
+        # Pass through any cached results
+        cached = {} if cache is None else cache.lookup(t for *_,t in block)
+        hits = [(pos,dict(pid=pid,title=t,**cached[t]))
+                for pos,pid,t in block if t in cached]
+        if len(hits) > 0:
+            yield ("cached",hits),None
+        # Pack the rest, up to the call limit
+        pending += [(pos,pid,t) for pos,pid,t in block if t not in cached]
+        ready,pending = planner.pack(pending)
+        for titles_subset in ready[:call_limit-batches]:
+            batches += 1
+            yield ("batch",titles_subset),_make_query(titles_subset,planner.query_count)
+    ready,_ = planner.pack(pending,final=True)
+    for titles_subset in ready[:max(call_limit-batches,0)]:
+        yield ("batch",titles_subset),_make_query(titles_subset,planner.query_count)
+
+def _match_entities(titles_subset,js,cache,query_count):
+    '''Match the titles in a batch to the entities in the response,
+    returning a list of (position, result) pairs'''
+    # Index the results by title (the first result wins)
+    entities = {}
+    for row in js["entities"]:
+        entities.setdefault(row["Ti"],row)
+    # If the results were truncated, a missing title isn't a
+    # confirmed miss, so shouldn't be cached
+    truncated = len(js["entities"]) >= query_count
+    results = []
+    new_results = {}
+    for pos,pid,t in titles_subset:
+        if t in entities:
+            row = entities[t]
+            insts = list(set(author["AfN"] for author in row["AA"] if "AfN" in author))
+            result = dict(institutes=insts,citations=row["CC"],
+                          date=row["D"],matched=True)
+        # Default in case no match is found
+        else:
+            result = dict(matched=False)
+        results.append((pos,dict(pid=pid,title=t,**result)))
+        if result["matched"] or not truncated:
+            new_results[t] = result
+    if cache is not None:
+        cache.store(new_results)
+    return results
+
+def _resolve_batch(titles_subset,response,engine,planner,cache):
+    '''
+    Return the (position, result) pairs for a posted batch. If MAK
+    rejected the batch, or truncated its results, the unmatched titles
+    are split in two and each half is re-posted. Titles which can't be
+    re-posted due to the call limit are left out.
+    '''
+    outcome = planner.record(titles_subset,response)
+    engine._emit("mak.batches_"+outcome)
+    engine._emit("mak.titles_posted",len(titles_subset))
+    if outcome == "rejected":
+        results = []
+        todo = titles_subset
+    else:
+        engine._emit("mak.entities",len(response.js["entities"]))
+        results = _match_entities(titles_subset,response.js,cache,
+                                  planner.query_count)
+        if outcome == "ok":
+            return results
+        # Keep the matches, and retry the rest
+        todo = [item for item,(_,result) in zip(titles_subset,results)
+                if not result["matched"]]
+        results = [(pos,result) for pos,result in results if result["matched"]]
+    # Can't split a single title any further
+    if len(titles_subset) == 1:
+        return results + [(pos,dict(pid=pid,title=t,matched=False))
+                          for pos,pid,t in todo]
+    half = (len(todo)+1)//2
+    for part in (todo[:half],todo[half:]):
+        if len(part) == 0:
+            continue
+        response = engine.post_response(_make_query(part,planner.query_count))
+        if response is not None:
+            results += _resolve_batch(part,response,engine,planner,cache)
+    return results
+
+def _iter_results(titles,engine,cache,planner):
+    '''Yield lists of (position, result) pairs for the (position, ID,
+    title) triples, one list per batch (or block of cached results)'''
+    jobs = _iter_jobs(titles,cache,planner,engine.call_limit)
+    for (kind,payload),response in engine.imap(jobs):
+        if kind == "cached":
+            engine._emit("mak.cache_hits",len(payload))
+            yield payload
+        # Not posted, since retries used up the call limit
+        elif response is None:
+            continue
+        else:
+            yield _resolve_batch(payload,response,engine,planner,cache)
+
 '''Find matches to titles from the MAK database.
 
     raw_titles: A list of titles in the form (id, title)
     call_limit: The maximum number of MAK API calls. 
                 NB: Nesta's allowance is 10,000 per month.
+    concurrency: The number of queries to have in flight at once
+    calls_per_second: Rate limit for calls to the API (None for no limit)
+    api_url: The MAK evaluate endpoint
+    cache_path: Path to an SQLite file of previous results (None for no
+                caching). Cached titles are not queried again.
+    metrics: Optional callback for timings and counts, see MakQueryEngine
 '''
-def mak_from_titles(raw_titles,call_limit):
+def mak_from_titles(raw_titles,call_limit,concurrency=1,
+                    calls_per_second=None,api_url=API_URL,cache_path=None,
+                    metrics=None):
 
     # Make arXiv titles match MAK title format (strip non-alphanums,
     # allowing foreign chars)
+    start = time.perf_counter()
     tp = TitleProcessor()
-    titles = [(pid,tp.process_title(t)) for pid,t in raw_titles]
+    titles = [(pos,pid,tp.process_title(t))
+              for pos,(pid,t) in enumerate(raw_titles)]
 
-    # Maximum of title_count titles, returning query_count results
-    title_count = 600
-    title_offset = 0
-    query_count = 1000
-
-    # Count the number of calls for book-keeping
-    calls = 0
-
-    # Iterate until done
-    data = []
-    while title_offset < len(titles):
-        # A soft limit so that we don't overrun the API limit
-        if calls >= call_limit:
-            break
-        calls += 1
-        # Get the index of the final title
-        last_title = title_offset+title_count
-        # Python indexing [n:None] will return n --> end
-        if last_title > len(titles):
-            last_title = None
-        # Get the title subset for this query
-        titles_subset = titles[title_offset:last_title]
-        title_offset += title_count        
-        # Generate the MAK query (OR statement of titles (Ti))
-        expr = ["Ti='"+t+"'" for _,t in titles_subset]
-        print("Posting",len(expr),"queries")
-        expr = ','.join(expr)
-        expr = "expr=OR("+expr+")"
-        # Write and launch the query
-        query = expr+"&count="+str(query_count)+"&attributes="+",".join(FIELDS)
-        r = requests.post('https://westus.api.cognitive.microsoft.com/academic/v1.0/evaluate', 
-                          data=query.encode("utf-8"), headers=HEADERS)
-        try:
-            js = r.json()
-        except json.decoder.JSONDecodeError as err:
-            print("Error with status code ",r.status_code)
-            print(r.text)
-            raise err
-        # Print out some stats
-        print("Got",len(js["entities"]),"results")
-        # Append the results to the output
-        for pid,t in titles_subset:
-            # Flag in case no match is found
-            matched = False
-            for row in js["entities"]:
-                if t != row["Ti"]:
-                    continue
-                insts = list(set(author["AfN"] for author in row["AA"] if "AfN" in author))
-                data.append(dict(pid=pid,title=t,institutes=insts,
-                                 citations=row["CC"],date=row["D"],matched=True))
-                matched = True
-                break
-            # Default in case no match is found
-            if not matched:
-                data.append(dict(pid=pid,title=t,matched=False))
+    # Launch the queries
+    engine = MakQueryEngine(call_limit,concurrency=concurrency,
+                            calls_per_second=calls_per_second,
+                            api_url=api_url,metrics=metrics)
+    engine._emit("mak.process_titles_seconds",time.perf_counter()-start)
+    cache = None if cache_path is None else TitleCache(cache_path)
+    planner = BatchPlanner()
+    results = []
+    for batch_results in _iter_results(titles,engine,cache,planner):
+        results += batch_results
+    calls = engine.calls
+    # Restore the input order
+    data = [result for _,result in sorted(results,key=lambda x:x[0])]
 
     # Print summary statistics
     nmatch = 0 
@@ -139,12 +601,67 @@ def mak_from_titles(raw_titles,call_limit):
         nmatch += 1
         if row["citations"] > 0 and len(row["institutes"]) > 0:
             nboth += 1
+    planner.summary()
     print("Made",calls,"calls")
     print("Got",nmatch,"matches from",len(data),"queries, of which",
           nboth,"contained both institutes and citation information")
     # Done
     return data
 
+'''Streaming version of mak_from_titles, yielding a list of results per
+batch, so that neither the inputs nor the outputs need to fit in memory.
+
+    raw_titles: An iterable of titles in the form (id, title)
+    call_limit, concurrency, calls_per_second, api_url, cache_path,
+    metrics: As for mak_from_titles
+    output_path: A JSON-lines file to which results are appended
+    checkpoint_path: A JSON file recording the input position up to which
+                     all titles have been processed (and any processed
+                     beyond it). These are skipped on start-up, so that an
+                     interrupted run can be resumed if raw_titles are
+                     given in the same order.
+'''
+def stream_mak_from_titles(raw_titles,call_limit,output_path=None,
+                           checkpoint_path=None,concurrency=1,
+                           calls_per_second=None,api_url=API_URL,
+                           cache_path=None,metrics=None):
+    # Skip any positions processed by a previous run. Results arrive out
+    # of order, so positions beyond the first unprocessed one are kept
+    # until it catches up with them.
+    position,done = 0,set()
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        position,done = checkpoint["position"],set(checkpoint["done"])
+    tp = TitleProcessor()
+    titles = ((pos,pid,tp.process_title(t)) for pos,(pid,t)
+              in islice(enumerate(raw_titles),position,None) if pos not in done)
+
+    engine = MakQueryEngine(call_limit,concurrency=concurrency,
+                            calls_per_second=calls_per_second,
+                            api_url=api_url,metrics=metrics)
+    cache = None if cache_path is None else TitleCache(cache_path)
+    planner = BatchPlanner()
+    for batch_results in _iter_results(titles,engine,cache,planner):
+        records = [result for _,result in batch_results]
+        # Write the results before marking them as done
+        if output_path is not None:
+            with open(output_path,"a") as f:
+                for record in records:
+                    f.write(json.dumps(record)+"\n")
+        if checkpoint_path is not None:
+            done.update(pos for pos,_ in batch_results)
+            while position in done:
+                done.remove(position)
+                position += 1
+            tmp_path = checkpoint_path+".tmp"
+            with open(tmp_path,"w") as f:
+                json.dump(dict(position=position,done=sorted(done)),f)
+            os.replace(tmp_path,checkpoint_path)
+        yield records
+    planner.summary()
+    print("Made",engine.calls,"calls")
+
 # Main example
 if __name__ == "__main__":
 
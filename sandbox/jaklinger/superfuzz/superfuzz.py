@@ -1,29 +1,153 @@
 import math
+import heapq
 from functools import reduce
+from multiprocessing import Pool
+
+def _length_norm(s1,s2):
+    '''Ratio of the shorter to the longer string length'''
+    norm = len(s1)/len(s2)
+    if norm > 1:
+        norm = 1/norm
+    return norm
+
+def _combine(scores,norm):
+    '''Score = Sqrt(Sum_a(score_a^2) / N_a), scaled by norm'''
+    scores_sqrd = map(lambda x:x*x,scores)
+    sum_scores_sqrd = reduce(lambda x,y:x+y,scores_sqrd)
+    return math.sqrt(sum_scores_sqrd / len(scores)) * norm
 
 def superfuzz(s1,s2,algs,length_norm=False):
     # Calculate the score from each algorithm
     scores = [alg(s1,s2) for alg in algs]
-    # Score = Sqrt(Sum_a(score_a^2) / N_a)
-    scores_sqrd = map(lambda x:x*x,scores)
-    sum_scores_sqrd = reduce(lambda x,y:x+y,scores_sqrd)    
-    score = math.sqrt(sum_scores_sqrd / len(scores))
     # Calculate length normalisation
     norm = 1
     if length_norm:
-        norm = len(s1)/len(s2)
-        if norm > 1:
-            norm = 1/norm
+        norm = _length_norm(s1,s2)
     # Done
-    return score * norm
+    return _combine(scores,norm)
+
+def length_ratio_bound(s1,s2):
+    '''Upper bound on fuzz.ratio(s1,s2), from the string lengths alone'''
+    total = len(s1) + len(s2)
+    if total == 0:
+        return 100
+    return math.ceil(200*min(len(s1),len(s2))/total)
+
+def _bounded_superfuzz(s1,s2,algs,bounds,length_norm,min_score):
+    '''As superfuzz, but returns None as soon as the score is known
+    to be below min_score, before running any remaining algorithms'''
+    norm = 1
+    if length_norm:
+        norm = _length_norm(s1,s2)
+    # Upper bound on each algorithm's score, before running any of them
+    maxes = [100 if bound is None else bound(s1,s2) for bound in bounds]
+    if _combine(maxes,norm) < min_score:
+        return None
+    # Replace the bounds by the actual scores, one algorithm at a time
+    for i,alg in enumerate(algs):
+        maxes[i] = alg(s1,s2)
+        if _combine(maxes,norm) < min_score:
+            return None
+    return _combine(maxes,norm)
+
+def _topk_row(query,choices,algs,bounds,k,min_score,length_norm):
+    '''The top k (index, score) pairs from choices for query'''
+    heap = []
+    threshold = min_score
+    for idx,choice in enumerate(choices):
+        score = _bounded_superfuzz(query,choice,algs,bounds,
+                                   length_norm,threshold)
+        if score is None:
+            continue
+        # Ties are broken by the earliest choice
+        item = (score,-idx)
+        if len(heap) < k:
+            heapq.heappush(heap,item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap,item)
+        # Any further pair needs to beat the current k-th best
+        if len(heap) == k:
+            threshold = max(min_score,heap[0][0])
+    return [(-idx,score) for score,idx in sorted(heap,reverse=True)]
+
+def _matrix_row(query,choices,algs,bounds,min_score,length_norm):
+    '''Scores of query against each of choices, with 0 for any pairs
+    scoring below min_score'''
+    row = []
+    for choice in choices:
+        score = _bounded_superfuzz(query,choice,algs,bounds,
+                                   length_norm,min_score)
+        row.append(0 if score is None else score)
+    return row
+
+'''The arguments shared by each worker process'''
+_worker_args = None
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+def _topk_worker(query):
+    return _topk_row(query,*_worker_args)
+
+def _matrix_worker(query):
+    return _matrix_row(query,*_worker_args)
+
+def _run(worker,row_func,queries,args,workers,chunksize):
+    '''Apply row_func to each query, optionally over a pool of processes'''
+    if workers <= 1:
+        return [row_func(query,*args) for query in queries]
+    with Pool(workers,initializer=_init_worker,initargs=args) as pool:
+        return pool.map(worker,queries,chunksize=chunksize)
+
+def superfuzz_matrix(queries,choices,algs,length_norm=False,min_score=0,
+                     bounds=None,workers=1,chunksize=100):
+    '''
+    Calculate superfuzz for every pair of queries and choices.
+
+    queries, choices: lists of strings
+    algs, length_norm: as for superfuzz
+    min_score: pairs scoring below this are returned as 0, and are
+               skipped as soon as they are known to fall below it
+    bounds: optional list (one per alg) of functions giving an upper
+            bound on each alg's score for a pair of strings, e.g.
+            length_ratio_bound for fuzz.ratio. None means no bound.
+    workers: number of processes over which to split the queries
+    chunksize: number of queries sent to a worker at a time
+
+    Returns a list (per query) of lists (per choice) of scores.
+    '''
+    if bounds is None:
+        bounds = [None]*len(algs)
+    args = (list(choices),algs,bounds,min_score,length_norm)
+    return _run(_matrix_worker,_matrix_row,queries,args,workers,chunksize)
+
+def superfuzz_topk(queries,choices,algs,k=5,min_score=0,length_norm=False,
+                   bounds=None,workers=1,chunksize=100):
+    '''
+    Find the k best-scoring choices for each query. Once k choices have
+    been found for a query, any pair which can't beat the k-th best
+    score is skipped.
+
+    Arguments are as for superfuzz_matrix. Returns a list (per query) of
+    up to k (choice index, score) pairs, in descending order of score.
+    '''
+    if bounds is None:
+        bounds = [None]*len(algs)
+    args = (list(choices),algs,bounds,k,min_score,length_norm)
+    return _run(_topk_worker,_topk_row,queries,args,workers,chunksize)
 
 if __name__ == "__main__":
     from fuzzywuzzy import fuzz
     s1 = "joel is a good student for a limited time"
     s2 = "a limited god studies time"
-    
+
     print(superfuzz(s1,s2,[fuzz.ratio]))
     print(superfuzz(s1,s2,[fuzz.ratio],length_norm=True))
     print(superfuzz(s1,s2,[fuzz.ratio,fuzz.token_sort_ratio]))
-    print(superfuzz(s1,s2,[fuzz.ratio,fuzz.token_sort_ratio],length_norm=True))    
-                    
+    print(superfuzz(s1,s2,[fuzz.ratio,fuzz.token_sort_ratio],length_norm=True))
+
+    choices = [s1,s2,"joel is a student","a limited time"]
+    print(superfuzz_topk([s2],choices,[fuzz.ratio],k=2,
+                         bounds=[length_ratio_bound]))
+